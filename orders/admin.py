@@ -1,7 +1,7 @@
-from django.contrib import admin
-from django.contrib.admin import StackedInline
+from django.contrib import admin, messages
+from django.contrib.admin import StackedInline, TabularInline
 
-from .models import Deliver, Order, OrderItem
+from .models import Deliver, Order, OrderItem, OrderStatusEvent
 
 
 @admin.register(Deliver)
@@ -20,6 +20,48 @@ class OrderItemInline(StackedInline):
     extra = 0
 
 
+class OrderStatusEventInline(TabularInline):
+    model = OrderStatusEvent
+    fields = [
+        "created",
+        "from_status",
+        "to_status",
+        "source",
+        "user",
+    ]
+    readonly_fields = fields
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+def make_transition_action(status: str):
+    """Return admin action moving selected orders to given status."""
+    status_title = dict(Order.STATUS_CHOICES)[status]
+
+    @admin.action(description=f"Перевести в статус «{status_title}»")
+    def transition_action(modeladmin, request, queryset):
+        selected_count = queryset.count()
+        moved_count = len(Order.transition(queryset, status, source="admin", user=request.user))
+        modeladmin.message_user(request, f"Статус «{status_title}» установлен заказам: {moved_count}")
+        if moved_count < selected_count:
+            modeladmin.message_user(
+                request,
+                f"Пропущено заказов, которые нельзя перевести в этот статус: {selected_count - moved_count}",
+                messages.WARNING,
+            )
+
+    transition_action.__name__ = f"transition_to_{status}"
+    return transition_action
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     model = Order
@@ -33,16 +75,23 @@ class OrderAdmin(admin.ModelAdmin):
         "is_paid",
         "total_price",
     ]
+    list_select_related = ["client", "delivery"]
     list_filter = [
         "status",
         "is_paid",
     ]
+    # Statuses are changed with actions only, so that transitions are checked and logged
+    actions = [make_transition_action(status) for status in ("shipped", "delivered", "returned")]
     readonly_fields = [
+        "status",
+        "is_paid",
         "created",
         "updated",
+        "items_count",
+        "items_price",
         "total_price",
     ]
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderStatusEventInline]
     fieldsets = [
         (
             "Клиент и контактные данные",
@@ -59,6 +108,8 @@ class OrderAdmin(admin.ModelAdmin):
             "Способ оплаты и статус",
             {
                 "fields": [
+                    "items_count",
+                    "items_price",
                     "total_price",
                     "payment",
                     "status",
@@ -100,3 +151,4 @@ class OrderItemAdmin(admin.ModelAdmin):
         "price",
         "quantity",
     ]
+    list_select_related = ["order", "product_position__product", "product_position__seller"]
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from orders.payments import PaymentBatchProcessor
+
+
+class Command(BaseCommand):
+    """
+    Verify queued payments in batches (consumer of the "batch" payment processing mode).
+    """
+
+    help = """
+    Проверяет оплаты заказов пачками из очереди (режим PAYMENT_PROCESSING_MODE=batch).
+    Можно запускать несколько обработчиков одновременно. Выводит размер пачки и время обработки.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Максимальный размер пачки")
+        parser.add_argument("--flush-interval", type=float, help="Пауза в секундах, если очередь пуста")
+        parser.add_argument("--max-batches", type=int, help="Остановиться после указанного количества пачек")
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        processor = PaymentBatchProcessor(batch_size=options["batch_size"], flush_interval=options["flush_interval"])
+        metrics = processor.metrics
+
+        def on_batch(size):
+            if options["verbosity"] > 1:
+                print(f"Обработана пачка оплат: {size}, оплачено всего: {metrics.paid}")
+
+        try:
+            processor.run(max_batches=options["max_batches"], on_batch=on_batch)
+        except KeyboardInterrupt:
+            pass
+
+        print("Обработано пачек:", metrics.batches)
+        print("Обработано оплат:", metrics.payments, "из них успешных:", metrics.paid)
+        print(f"Средний размер пачки: {metrics.avg_batch_size:.1f}, максимальный: {metrics.max_batch_size}")
+        print(f"Среднее время обработки пачки: {metrics.avg_processing_time * 1000:.1f} мс")
+        print(f"Максимальное ожидание оплаты в очереди: {metrics.max_wait_time:.1f} с")
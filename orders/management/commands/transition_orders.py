@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Move orders to given status, e.g. mark a fulfilment batch as shipped.
+    """
+
+    help = """
+    Переводит заказы в указанный статус, например отмечает партию заказов отправленными.
+    Заказы, которые нельзя перевести в этот статус из текущего, пропускаются.
+    Все переходы записываются в журнал изменений статусов.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("status", choices=list(Order.TRANSITIONS), help="Новый статус заказов")
+        parser.add_argument("--ids", type=int, nargs="+", default=[], help="Номера заказов")
+        parser.add_argument("--ids-file", help="Файл с номерами заказов, по одному в строке")
+        parser.add_argument("--from-status", choices=list(Order.TRANSITIONS), help="Все заказы с этим статусом")
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        order_ids = list(options["ids"])
+        if options["ids_file"]:
+            with open(options["ids_file"]) as ids_file:
+                order_ids += [int(line) for line in ids_file if line.strip()]
+
+        if order_ids:
+            orders = Order.objects.filter(pk__in=order_ids)
+        elif options["from_status"]:
+            orders = Order.objects.all()
+        else:
+            raise CommandError("Укажите заказы: --ids, --ids-file или --from-status")
+        if options["from_status"]:
+            orders = orders.filter(status=options["from_status"])
+
+        selected_qty = orders.count()
+        moved_qty = len(Order.transition(orders, options["status"], source="command"))
+        print("Переведено заказов:", moved_qty)
+        print("Пропущено заказов:", selected_qty - moved_qty)
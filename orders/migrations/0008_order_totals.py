@@ -0,0 +1,63 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:30
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+    items_price = Coalesce(
+        Subquery(items.annotate(total=Sum("price")).values("total")), Value(Decimal(0))
+    )
+    Order.objects.update(
+        items_price=items_price,
+        items_count=Coalesce(
+            Subquery(items.annotate(total=Sum("quantity")).values("total")), 0
+        ),
+        total_price=items_price + F("delivery_price"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0007_deliver_is_express"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="items_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="количество товаров"
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="items_price",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                editable=False,
+                max_digits=10,
+                verbose_name="стоимость товаров",
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_price",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                editable=False,
+                max_digits=10,
+                verbose_name="общая стоимость",
+            ),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0009_order_history_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="payment_key",
+            field=models.UUIDField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="ключ попытки оплаты",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="order",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("created", "Сформирован"),
+                    ("processing", "Оплачивается"),
+                    ("unpaid", "Не оплачен"),
+                    ("paid", "Оплачен"),
+                    ("shipped", "В пути"),
+                    ("delivered", "Доставлен"),
+                    ("returned", "Возвращен"),
+                ],
+                default="created",
+                max_length=10,
+                verbose_name="статус заказа",
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0010_order_payment_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingPayment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payment_key", models.UUIDField(verbose_name="ключ попытки оплаты")),
+                (
+                    "card_number",
+                    models.CharField(max_length=32, verbose_name="номер карты"),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="создан"
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="orders.order",
+                        verbose_name="заказ",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "платёж в очереди",
+                "verbose_name_plural": "платежи в очереди",
+            },
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("orders", "0011_pendingpayment"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderStatusEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "from_status",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("created", "Сформирован"),
+                            ("processing", "Оплачивается"),
+                            ("unpaid", "Не оплачен"),
+                            ("paid", "Оплачен"),
+                            ("shipped", "В пути"),
+                            ("delivered", "Доставлен"),
+                            ("returned", "Возвращен"),
+                        ],
+                        max_length=10,
+                        verbose_name="прежний статус",
+                    ),
+                ),
+                (
+                    "to_status",
+                    models.CharField(
+                        choices=[
+                            ("created", "Сформирован"),
+                            ("processing", "Оплачивается"),
+                            ("unpaid", "Не оплачен"),
+                            ("paid", "Оплачен"),
+                            ("shipped", "В пути"),
+                            ("delivered", "Доставлен"),
+                            ("returned", "Возвращен"),
+                        ],
+                        max_length=10,
+                        verbose_name="новый статус",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("checkout", "Оформление заказа"),
+                            ("payment", "Оплата"),
+                            ("admin", "Администратор"),
+                            ("command", "Команда управления"),
+                        ],
+                        max_length=10,
+                        verbose_name="источник",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, verbose_name="создано"),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="status_events",
+                        to="orders.order",
+                        verbose_name="заказ",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "изменение статуса заказа",
+                "verbose_name_plural": "изменения статусов заказов",
+                "ordering": ["created", "pk"],
+                "indexes": [
+                    models.Index(
+                        fields=["order", "created"], name="order_status_event_idx"
+                    )
+                ],
+            },
+        ),
+    ]
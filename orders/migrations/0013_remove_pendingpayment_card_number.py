@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 21:06
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0012_orderstatusevent"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="pendingpayment",
+            name="card_number",
+        ),
+    ]
@@ -1,9 +1,22 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from typing import Optional
 
-from products.models import ProductPosition
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import (ProductPosition, ProductPriceSummary,
+                             StockReservation)
 from users.models import CustomUser
 
 
+class OutOfStockError(Exception):
+    """Raised when none of the ordered product positions is left in stock."""
+
+
 class Deliver(models.Model):
     """Model for storing delivery options."""
 
@@ -36,6 +49,16 @@ class Deliver(models.Model):
     def __str__(self):
         return self.title
 
+    def get_price(self, products_price: Decimal, sellers_qty: int) -> Decimal:
+        """Return delivery price for products of given total price from given number of sellers."""
+        if not self.is_express:
+            if products_price < self.free_threshold or sellers_qty > 1:
+                return self.price
+            if products_price > self.free_threshold and sellers_qty == 1:
+                return Decimal(0)
+
+        return self.price
+
 
 class Order(models.Model):
     """Model for storing orders."""
@@ -47,6 +70,7 @@ class Order(models.Model):
 
     STATUS_CHOICES = (
         ("created", "Сформирован"),
+        ("processing", "Оплачивается"),
         ("unpaid", "Не оплачен"),
         ("paid", "Оплачен"),
         ("shipped", "В пути"),
@@ -54,6 +78,17 @@ class Order(models.Model):
         ("returned", "Возвращен"),
     )
 
+    # Statuses the order can be moved to from each status (see `Order.transition`)
+    TRANSITIONS = {
+        "created": ("processing",),
+        "processing": ("paid", "unpaid"),
+        "unpaid": ("processing",),
+        "paid": ("shipped", "returned"),
+        "shipped": ("delivered", "returned"),
+        "delivered": ("returned",),
+        "returned": (),
+    }
+
     client = models.ForeignKey(
         CustomUser,
         verbose_name="клиент",
@@ -73,6 +108,26 @@ class Order(models.Model):
         decimal_places=2,
         default=0,
     )
+    # Totals are kept up to date on `OrderItem` changes (see `orders.signals`)
+    items_price = models.DecimalField(
+        verbose_name="стоимость товаров",
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+    )
+    items_count = models.PositiveIntegerField(
+        verbose_name="количество товаров",
+        default=0,
+        editable=False,
+    )
+    total_price = models.DecimalField(
+        verbose_name="общая стоимость",
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+    )
     payment = models.CharField(
         verbose_name="способ оплаты",
         max_length=10,
@@ -111,6 +166,13 @@ class Order(models.Model):
         verbose_name="оплачен",
         default=False,
     )
+    # Key of the current payment attempt, so that each attempt is processed once (see `Order.start_payment`)
+    payment_key = models.UUIDField(
+        verbose_name="ключ попытки оплаты",
+        null=True,
+        blank=True,
+        editable=False,
+    )
     is_deleted = models.BooleanField(
         verbose_name="удален",
         default=False,
@@ -126,18 +188,228 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            # Order history of the client, paginated by creation time (see `users.views.HistoryOrderView`)
+            models.Index(fields=["client", "created", "id"], name="order_client_created_idx"),
+            models.Index(fields=["status", "created"], name="order_status_created_idx"),
+        ]
         verbose_name = "заказ"
         verbose_name_plural = "заказы"
 
     def __str__(self):
         return f"Заказ №{self.id}"
 
-    @property
-    def total_price(self):
-        """Delivery price plus sum of all order item prices."""
-        order_items = OrderItem.objects.filter(order=self)
-        total_items_price = sum([item.price for item in order_items])
-        return total_items_price + self.delivery_price
+    @classmethod
+    def place(cls, lines: dict, reservation_key: str = None, **fields) -> "Order":
+        """
+        Create the order with items for the cart lines and take ordered quantities off the stock, in one transaction.
+
+        Product positions are locked with one `SELECT ... FOR UPDATE` query, so concurrent orders can't oversell
+        them: quantities exceeding the stock not held for other buyers are reduced to what's left, and positions
+        out of stock are skipped. Holds of the buyer are released, as the ordered quantities leave the stock.
+        Raises `OutOfStockError` if there's nothing left to order.
+        Delivery price is calculated from the ordered items, as their quantities may be reduced.
+
+        :param lines: cart lines, `{"<product position id>": {"quantity": <int>, "price": "<price with discount>"}}`.
+        :param reservation_key: session key the buyer's stock reservations are held with (see `products.reservations`).
+        :param fields: values of the order fields, except for totals and delivery price.
+        """
+        with transaction.atomic():
+            product_positions = {
+                product_position.pk: product_position
+                for product_position in ProductPosition.objects.select_for_update()
+                .filter(pk__in=[int(product_position_id) for product_position_id in lines])
+                .order_by("pk")
+            }
+            reserved_by_others = StockReservation.get_reserved_quantities(
+                product_positions.keys(), exclude_session_key=reservation_key
+            )
+
+            order_items = []
+            ordered_quantities = {}
+            for product_position_id, line in lines.items():
+                product_position = product_positions.get(int(product_position_id))
+                if product_position is None:
+                    continue
+                available = product_position.quantity - reserved_by_others.get(product_position.pk, 0)
+                quantity = min(int(line["quantity"]), available)
+                if quantity <= 0:
+                    continue
+                order_items.append(
+                    OrderItem(
+                        product_position=product_position,
+                        price=Decimal(line["price"]) * quantity,
+                        quantity=quantity,
+                    )
+                )
+                ordered_quantities[product_position.pk] = quantity
+
+            if not order_items:
+                raise OutOfStockError
+
+            items_price = sum(order_item.price for order_item in order_items)
+            delivery = fields.get("delivery")
+            if delivery is not None:
+                sellers_qty = len({order_item.product_position.seller_id for order_item in order_items})
+                fields["delivery_price"] = delivery.get_price(items_price, sellers_qty)
+            order = cls.objects.create(
+                items_price=items_price,
+                items_count=sum(order_item.quantity for order_item in order_items),
+                **fields,
+            )
+            OrderStatusEvent.objects.create(order=order, to_status=order.status, source="checkout", user=order.client)
+            for order_item in order_items:
+                order_item.order = order
+            # Totals are already set, so signals of `OrderItem` are not needed here
+            OrderItem.objects.bulk_create(order_items)
+
+            ProductPosition.objects.filter(pk__in=ordered_quantities).update(
+                quantity=F("quantity")
+                - Case(
+                    *(When(pk=pk, then=Value(quantity)) for pk, quantity in ordered_quantities.items()),
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+
+            if reservation_key:
+                StockReservation.objects.filter(session_key=reservation_key).delete()
+
+            # Queryset update doesn't send `post_save`, so refresh what depends on positions stock here
+            product_ids = list({product_position.product_id for product_position in product_positions.values()})
+            transaction.on_commit(lambda: ProductPriceSummary.refresh_for_products(product_ids))
+        return order
+
+    def save(self, *args, **kwargs):
+        """Save the order with its total price: delivery price plus sum of all order item prices."""
+        self.total_price = self.items_price + self.delivery_price
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "delivery_price" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "total_price"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def get_source_statuses(cls, status: str) -> list:
+        """Return statuses the order can be moved to given status from."""
+        return [source_status for source_status, statuses in cls.TRANSITIONS.items() if status in statuses]
+
+    @classmethod
+    def transition(cls, orders, status: str, source: str, user=None, **fields) -> list:
+        """
+        Move orders to given status and log the transitions, skipping orders whose current status doesn't allow it.
+        Return ids of moved orders.
+
+        Orders are locked and their current statuses read in one query, then moved with a single update,
+        so concurrent transitions can't both succeed (compare-and-set on the status). Any number of orders
+        is moved in one call, e.g. a whole fulfilment batch.
+
+        :param orders: queryset of orders or order ids.
+        :param status: new status of the orders.
+        :param source: what made the transition, one of `OrderStatusEvent.SOURCE_CHOICES`.
+        :param user: user who made the transition, if any.
+        :param fields: other order fields to update along with the status.
+        """
+        if status not in cls.TRANSITIONS:
+            raise ValueError(f"Unknown order status: {status}")
+        if not isinstance(orders, models.QuerySet):
+            orders = cls.objects.filter(pk__in=list(orders))
+
+        with transaction.atomic():
+            # Conditions of the queryset are checked again on the locked rows, so they can't be changed meanwhile
+            current_statuses = list(
+                orders.select_for_update(of=("self",))
+                .filter(status__in=cls.get_source_statuses(status))
+                .order_by("pk")
+                .values_list("pk", "status")
+            )
+            order_ids = [order_id for order_id, _ in current_statuses]
+            if not order_ids:
+                return []
+
+            cls.objects.filter(pk__in=order_ids).update(status=status, updated=timezone.now(), **fields)
+            OrderStatusEvent.objects.bulk_create(
+                [
+                    OrderStatusEvent(
+                        order_id=order_id,
+                        from_status=from_status,
+                        to_status=status,
+                        source=source,
+                        user=user,
+                    )
+                    for order_id, from_status in current_statuses
+                ],
+                batch_size=1000,
+            )
+        return order_ids
+
+    @classmethod
+    def start_payment(cls, order_id) -> Optional[str]:
+        """
+        Start payment attempt of the order: move it to "processing" status with a new payment key and return the key.
+        Return None if the order can't be paid now (it's paid or its payment is being processed already),
+        so that duplicate submissions don't start more attempts.
+        """
+        payment_key = uuid.uuid4()
+        started = cls.transition(
+            cls.objects.filter(pk=order_id, is_paid=False), "processing", source="payment", payment_key=payment_key
+        )
+        return str(payment_key) if started else None
+
+    @classmethod
+    def complete_payment(cls, order_id, payment_key: str, is_paid: bool) -> bool:
+        """
+        Finish the payment attempt with given key: mark the order as paid or unpaid.
+        Return False if the attempt is finished already or superseded, so that it's never processed twice.
+        """
+        return bool(
+            cls.transition(
+                cls.objects.filter(pk=order_id, payment_key=payment_key),
+                "paid" if is_paid else "unpaid",
+                source="payment",
+                is_paid=is_paid,
+            )
+        )
+
+    @classmethod
+    def complete_payments(cls, payment_keys, is_paid: bool) -> list:
+        """
+        Finish payment attempts with given keys with the same outcome, using a single update.
+        Return ids of orders whose attempts were finished (not finished already or superseded).
+        """
+        if not payment_keys:
+            return []
+        return cls.transition(
+            cls.objects.filter(payment_key__in=payment_keys),
+            "paid" if is_paid else "unpaid",
+            source="payment",
+            is_paid=is_paid,
+        )
+
+    @classmethod
+    def expire_payments(cls, timeout: timedelta) -> list:
+        """
+        Mark orders whose payment attempt is processed longer than `timeout` as unpaid, so that they can be paid again
+        (e.g. the verification task was lost). Return ids of these orders.
+        Late outcomes of expired attempts are dropped, as the orders are not in "processing" status anymore.
+        """
+        order_ids = cls.transition(
+            cls.objects.filter(status="processing", updated__lt=timezone.now() - timeout),
+            "unpaid",
+            source="payment",
+            is_paid=False,
+        )
+        PendingPayment.objects.filter(order_id__in=order_ids).delete()
+        return order_ids
+
+    @classmethod
+    def refresh_totals(cls, order_ids) -> None:
+        """Recalculate stored totals of orders with given ids from their items with a single update."""
+        items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+        items_price = Coalesce(Subquery(items.annotate(total=Sum("price")).values("total")), Value(Decimal(0)))
+        cls.objects.filter(pk__in=order_ids).update(
+            items_price=items_price,
+            items_count=Coalesce(Subquery(items.annotate(total=Sum("quantity")).values("total")), 0),
+            total_price=items_price + F("delivery_price"),
+        )
 
 
 class OrderItem(models.Model):
@@ -166,3 +438,85 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"Order {self.order.id}, Product: {self.product_position}"
+
+
+class PendingPayment(models.Model):
+    """Payment attempt waiting for verification in batch mode (see `orders.payments`)."""
+
+    order = models.ForeignKey(
+        Order,
+        verbose_name="заказ",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    # Card number is kept in the cache only (see `orders.payments.enqueue_payment`)
+    payment_key = models.UUIDField(verbose_name="ключ попытки оплаты")
+    created = models.DateTimeField(
+        verbose_name="создан",
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = "платёж в очереди"
+        verbose_name_plural = "платежи в очереди"
+
+    def __str__(self):
+        return f"Заказ №{self.order_id}, попытка {self.payment_key}"
+
+
+class OrderStatusEvent(models.Model):
+    """Transition of the order status. Events are only added, never changed (see `Order.transition`)."""
+
+    SOURCE_CHOICES = (
+        ("checkout", "Оформление заказа"),
+        ("payment", "Оплата"),
+        ("admin", "Администратор"),
+        ("command", "Команда управления"),
+    )
+
+    order = models.ForeignKey(
+        Order,
+        verbose_name="заказ",
+        on_delete=models.CASCADE,
+        related_name="status_events",
+    )
+    from_status = models.CharField(
+        verbose_name="прежний статус",
+        choices=Order.STATUS_CHOICES,
+        max_length=10,
+        blank=True,
+    )
+    to_status = models.CharField(
+        verbose_name="новый статус",
+        choices=Order.STATUS_CHOICES,
+        max_length=10,
+    )
+    source = models.CharField(
+        verbose_name="источник",
+        choices=SOURCE_CHOICES,
+        max_length=10,
+    )
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name="пользователь",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created = models.DateTimeField(
+        verbose_name="создано",
+        auto_now_add=True,
+    )
+
+    class Meta:
+        ordering = ["created", "pk"]
+        indexes = [
+            models.Index(fields=["order", "created"], name="order_status_event_idx"),
+        ]
+        verbose_name = "изменение статуса заказа"
+        verbose_name_plural = "изменения статусов заказов"
+
+    def __str__(self):
+        return f"Заказ №{self.order_id}: {self.from_status or '-'} -> {self.to_status}"
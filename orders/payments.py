@@ -0,0 +1,146 @@
+"""
+Contains payment verification of orders in two modes, chosen with `PAYMENT_PROCESSING_MODE` setting:
+- "single" (default): every payment attempt is checked by its own `check_card_number` task;
+- "batch": payment attempts are queued in `PendingPayment` table and checked in batches by the
+  `process_payments` management command, which applies each outcome with a single update.
+Card numbers are never saved in the database: in batch mode they are kept in the cache until the attempt
+is checked or expires (see `Order.expire_payments`).
+"""
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order, PendingPayment
+from products.popularity import ORDER_PAID_WEIGHT
+
+
+def get_card_number_cache_key(payment_key) -> str:
+    return f"payment_card_{payment_key}"
+
+
+def is_card_number_valid(card_number: str) -> bool:
+    """Payment system stub: even card numbers not ending with zero are accepted."""
+    card_number = card_number.replace(" ", "")
+    return card_number.isdigit() and int(card_number) % 2 == 0 and not card_number.endswith("0")
+
+
+def enqueue_payment(order_id: int, payment_key: str, card_number: str) -> None:
+    """Schedule verification of the payment attempt started with `Order.start_payment`."""
+    if getattr(settings, "PAYMENT_PROCESSING_MODE", "single") == "batch":
+        cache.set(
+            get_card_number_cache_key(payment_key),
+            card_number,
+            timeout=getattr(settings, "PAYMENT_PROCESSING_TIMEOUT", 900),
+        )
+        PendingPayment.objects.create(order_id=order_id, payment_key=payment_key)
+    else:
+        from orders.tasks import check_card_number
+
+        transaction.on_commit(lambda: check_card_number.delay(card_number, order_id, payment_key))
+
+
+class PaymentBatchMetrics:
+    """Counters of processed batches: sizes, processing time and time payments waited in the queue."""
+
+    def __init__(self):
+        self.batches = 0
+        self.payments = 0
+        self.paid = 0
+        self.max_batch_size = 0
+        self.processing_time = 0.0
+        self.max_wait_time = 0.0
+
+    def add_batch(self, size: int, paid: int, processing_time: float, wait_time: float) -> None:
+        self.batches += 1
+        self.payments += size
+        self.paid += paid
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.processing_time += processing_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    @property
+    def avg_batch_size(self) -> float:
+        return self.payments / self.batches if self.batches else 0.0
+
+    @property
+    def avg_processing_time(self) -> float:
+        return self.processing_time / self.batches if self.batches else 0.0
+
+
+class PaymentBatchProcessor:
+    """
+    Verify queued payment attempts in batches.
+
+    Batches are taken with `SELECT ... FOR UPDATE SKIP LOCKED`, so several consumers can run at once
+    without processing a payment twice. Orders are updated with one query per outcome, and attempts
+    which are finished already or superseded by a newer one are dropped.
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None):
+        """
+        :param batch_size: maximum number of payments taken at once (`PAYMENT_BATCH_SIZE` setting by default).
+        :param flush_interval: number of seconds to wait for more payments when the queue is drained
+                               (`PAYMENT_BATCH_FLUSH_INTERVAL` setting by default).
+        """
+        self.batch_size = batch_size or getattr(settings, "PAYMENT_BATCH_SIZE", 500)
+        self.flush_interval = flush_interval if flush_interval is not None else getattr(
+            settings, "PAYMENT_BATCH_FLUSH_INTERVAL", 1.0
+        )
+        self.metrics = PaymentBatchMetrics()
+
+    def process_batch(self) -> int:
+        """Verify one batch of queued payments and return its size."""
+        from products.tasks import update_orders_popularity
+
+        started = time.monotonic()
+        with transaction.atomic():
+            payments = list(
+                PendingPayment.objects.select_for_update(skip_locked=True)
+                .order_by("created")
+                .values_list("pk", "payment_key", "created")[: self.batch_size]
+            )
+            if not payments:
+                return 0
+
+            # Attempts whose card numbers are gone from the cache (expired or evicted) are not paid
+            cache_keys = [get_card_number_cache_key(payment_key) for _, payment_key, _ in payments]
+            card_numbers = cache.get_many(cache_keys)
+            keys_by_outcome = {True: [], False: []}
+            for (_, payment_key, _), cache_key in zip(payments, cache_keys):
+                keys_by_outcome[is_card_number_valid(card_numbers.get(cache_key, ""))].append(payment_key)
+            paid_order_ids = Order.complete_payments(keys_by_outcome[True], is_paid=True)
+            Order.complete_payments(keys_by_outcome[False], is_paid=False)
+            PendingPayment.objects.filter(pk__in=[payment[0] for payment in payments]).delete()
+            transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+            if paid_order_ids:
+                transaction.on_commit(lambda: update_orders_popularity.delay(paid_order_ids, ORDER_PAID_WEIGHT))
+
+        self.metrics.add_batch(
+            size=len(payments),
+            paid=len(paid_order_ids),
+            processing_time=time.monotonic() - started,
+            wait_time=(timezone.now() - payments[0][2]).total_seconds(),
+        )
+        return len(payments)
+
+    def run(self, max_batches: Optional[int] = None, on_batch=None) -> None:
+        """
+        Process batches until stopped (or `max_batches` are processed), waiting for `flush_interval`
+        whenever a batch is not full, so that payments are collected into batches under load.
+
+        :param on_batch: function called with the size of every processed batch.
+        """
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            size = self.process_batch()
+            if size:
+                batches += 1
+                if on_batch:
+                    on_batch(size)
+            if size < self.batch_size:
+                time.sleep(self.flush_interval)
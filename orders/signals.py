@@ -0,0 +1,14 @@
+"""
+Contains signal receivers keeping denormalized data of `orders` app up to date.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from orders.models import Order, OrderItem
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def on_order_item_changed(sender, instance, **kwargs):
+    """Recalculate stored totals of the order after any of its items is changed."""
+    Order.refresh_totals([instance.order_id])
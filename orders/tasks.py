@@ -1,14 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+
 from orders.models import Order
+from orders.payments import is_card_number_valid
+from products.popularity import ORDER_PAID_WEIGHT
+from products.tasks import update_products_popularity
 from store.celery import app
 
 
 @app.task
-def check_card_number(card_number, order_id):
-    order = Order.objects.get(pk=order_id)
-    if int(card_number.replace(" ", "")) % 2 == 0 and not card_number.endswith("0"):
-        order.status = "paid"
-        order.is_paid = True
-        order.save()
-    else:
-        order.status = "unpaid"
-        order.save()
+def check_card_number(card_number, order_id, payment_key):
+    """
+    Process the payment attempt of the order with given key.
+    The attempt is finished with a conditional update, so duplicate deliveries of the task are no-ops.
+    """
+    is_paid = is_card_number_valid(card_number)
+    if Order.complete_payment(order_id, payment_key, is_paid) and is_paid:
+        update_products_popularity.delay(order_id, ORDER_PAID_WEIGHT)
+
+
+@app.task
+def expire_stale_payments():
+    """Mark orders stuck in "processing" status longer than `PAYMENT_PROCESSING_TIMEOUT` seconds as unpaid."""
+    Order.expire_payments(timedelta(seconds=getattr(settings, "PAYMENT_PROCESSING_TIMEOUT", 900)))
@@ -1 +1,163 @@
-# Create your tests here.
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from orders.models import Deliver, Order, OrderStatusEvent, OutOfStockError
+from products.models import (Category, Product, ProductPosition, Seller,
+                             StockReservation)
+
+ORDER_FIELDS = {
+    "payment": "online",
+    "name": "Иван",
+    "phone": "79990000000",
+    "email": "ivan@example.com",
+    "city": "Москва",
+    "address": "ул. Ленина, 1",
+}
+
+
+class OrderTransitionTest(TestCase):
+    def create_order(self, status: str) -> Order:
+        return Order.objects.create(status=status, **ORDER_FIELDS)
+
+    def test_illegal_transitions_are_skipped(self):
+        created = self.create_order("created")
+        paid = self.create_order("paid")
+        returned = self.create_order("returned")
+
+        moved = Order.transition([created.pk, paid.pk, returned.pk], "shipped", source="admin")
+
+        self.assertEqual(moved, [paid.pk])
+        self.assertEqual(
+            dict(Order.objects.values_list("pk", "status")),
+            {created.pk: "created", paid.pk: "shipped", returned.pk: "returned"},
+        )
+        self.assertEqual(
+            list(OrderStatusEvent.objects.values_list("order_id", "from_status", "to_status")),
+            [(paid.pk, "paid", "shipped")],
+        )
+
+    def test_unknown_status_is_rejected(self):
+        order = self.create_order("created")
+
+        with self.assertRaises(ValueError):
+            Order.transition([order.pk], "lost", source="admin")
+
+    def test_payment_is_started_once(self):
+        order = self.create_order("created")
+
+        self.assertIsNotNone(Order.start_payment(order.pk))
+        self.assertIsNone(Order.start_payment(order.pk))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "processing")
+
+    def test_payment_is_completed_once(self):
+        order = self.create_order("created")
+        payment_key = Order.start_payment(order.pk)
+
+        self.assertTrue(Order.complete_payment(order.pk, payment_key, is_paid=True))
+        self.assertFalse(Order.complete_payment(order.pk, payment_key, is_paid=False))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.is_paid), ("paid", True))
+        self.assertEqual(OrderStatusEvent.objects.filter(order=order, source="payment").count(), 2)
+
+    def test_superseded_payment_is_not_completed(self):
+        order = self.create_order("created")
+        stale_key = Order.start_payment(order.pk)
+        Order.complete_payment(order.pk, stale_key, is_paid=False)
+        payment_key = Order.start_payment(order.pk)
+
+        self.assertFalse(Order.complete_payment(order.pk, stale_key, is_paid=True))
+        self.assertEqual(Order.complete_payments([stale_key, str(uuid.uuid4())], is_paid=True), [])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.is_paid), ("processing", False))
+
+        self.assertEqual(Order.complete_payments([payment_key, payment_key], is_paid=True), [order.pk])
+        self.assertEqual(Order.complete_payments([payment_key], is_paid=True), [])
+
+    def test_stale_payments_are_expired(self):
+        stale = self.create_order("created")
+        stale_key = Order.start_payment(stale.pk)
+        Order.objects.filter(pk=stale.pk).update(updated=timezone.now() - timedelta(hours=1))
+        fresh = self.create_order("created")
+        Order.start_payment(fresh.pk)
+
+        self.assertEqual(Order.expire_payments(timedelta(minutes=15)), [stale.pk])
+        self.assertFalse(Order.complete_payment(stale.pk, stale_key, is_paid=True))
+        self.assertEqual(
+            dict(Order.objects.values_list("pk", "status")),
+            {stale.pk: "unpaid", fresh.pk: "processing"},
+        )
+
+
+class OrderPlaceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title="Телевизоры")
+        seller = Seller.objects.create(
+            title="Магазин", description="", address="Москва", phone="79990000000", email="shop@example.com"
+        )
+        cls.delivery = Deliver.objects.create(title="Обычная", price=Decimal(200), free_threshold=Decimal(2000))
+        cls.positions = [
+            ProductPosition.objects.create(
+                product=Product.objects.create(title=f"Товар {index}", category=category),
+                seller=seller,
+                price=Decimal(500),
+                quantity=quantity,
+            )
+            for index, quantity in enumerate([5, 2])
+        ]
+
+    def get_lines(self, *quantities) -> dict:
+        return {
+            str(position.pk): {"quantity": quantity, "price": "500"}
+            for position, quantity in zip(self.positions, quantities)
+        }
+
+    def reserve(self, position: ProductPosition, quantity: int, session_key: str):
+        StockReservation.objects.create(
+            product_position=position,
+            session_key=session_key,
+            quantity=quantity,
+            expires=timezone.now() + timedelta(minutes=15),
+        )
+
+    def test_quantities_are_clamped_to_stock_not_held_by_others(self):
+        self.reserve(self.positions[0], 2, "other")
+        self.reserve(self.positions[0], 3, "buyer")
+
+        order = Order.place(self.get_lines(4, 3), reservation_key="buyer", delivery=self.delivery, **ORDER_FIELDS)
+
+        self.assertEqual(
+            dict(order.orderitem_set.values_list("product_position_id", "quantity")),
+            {self.positions[0].pk: 3, self.positions[1].pk: 2},
+        )
+        self.assertEqual((order.items_count, order.items_price), (5, Decimal(2500)))
+        # Free delivery, as the price of the ordered items is over the threshold
+        self.assertEqual(order.delivery_price, Decimal(0))
+        self.assertEqual(
+            dict(ProductPosition.objects.values_list("pk", "quantity")),
+            {self.positions[0].pk: 2, self.positions[1].pk: 0},
+        )
+        self.assertEqual(list(StockReservation.objects.values_list("session_key", flat=True)), ["other"])
+
+    def test_delivery_price_follows_clamped_items(self):
+        ProductPosition.objects.filter(pk=self.positions[0].pk).update(quantity=1)
+
+        order = Order.place(self.get_lines(5), delivery=self.delivery, **ORDER_FIELDS)
+
+        self.assertEqual(order.items_price, Decimal(500))
+        self.assertEqual(order.delivery_price, Decimal(200))
+        self.assertEqual(order.total_price, Decimal(700))
+
+    def test_nothing_left_in_stock(self):
+        self.reserve(self.positions[1], 2, "other")
+        ProductPosition.objects.filter(pk=self.positions[0].pk).update(quantity=0)
+
+        with self.assertRaises(OutOfStockError):
+            Order.place(self.get_lines(1, 1), reservation_key="buyer", delivery=self.delivery, **ORDER_FIELDS)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ProductPosition.objects.get(pk=self.positions[1].pk).quantity, 2)
@@ -2,7 +2,7 @@ from django.urls import path
 
 from orders.views import (CartView, CheckoutView, OrderDetailsView,
                           OrderListView, PaymentView, PaymentViewWithParams,
-                          ProgressPaymentView)
+                          ProgressPaymentView, payment_status)
 
 app_name = "orders"
 urlpatterns = [
@@ -11,6 +11,7 @@ urlpatterns = [
     path("payment/", PaymentView.as_view(), name="payment"),
     path("payment/<int:order_id>/", PaymentViewWithParams.as_view(), name="payment_with_params"),
     path("progress-payment", ProgressPaymentView.as_view(), name="progress-payment"),
+    path("payment-status/<int:pk>/", payment_status, name="payment_status"),
     path("orders/", OrderListView.as_view(), name="orders"),
     path("orders/<int:pk>/", OrderDetailsView.as_view(), name="order_detail"),
 ]
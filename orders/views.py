@@ -1,20 +1,27 @@
-from decimal import Decimal
-
 from django.conf import settings
 from django.contrib.auth import authenticate, login
+from django.db import transaction
+from django.http import Http404, HttpRequest, JsonResponse
 from django.shortcuts import redirect
-from django.urls import reverse, reverse_lazy
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
 from django.views.generic import FormView, TemplateView
 
 from products.cart import Cart
-from products.models import ProductPosition
+from products.popularity import ORDER_CREATED_WEIGHT
+from products.reservations import reserve_cart
+from products.tasks import update_products_popularity
 from products.views import BaseMixin
 from users.models import CustomUser
 
 from .forms import (CardNumberForm, CheckoutStep1, CheckoutStep2,
                     CheckoutStep3, CheckoutStep4)
-from .models import Deliver, Order, OrderItem
-from .tasks import check_card_number
+from .models import Deliver, Order, OrderItem, OutOfStockError
+from .payments import enqueue_payment
+
+# Ids of orders whose payment was submitted in the session
+PAYMENT_ORDERS_SESSION_ID = "payment_orders"
 
 
 class CartView(TemplateView):
@@ -51,9 +58,11 @@ class CheckoutView(BaseMixin, FormView):
             settings.ORDER_SESSION_ID, default={}
         )
 
+        # Share one cart with the template, so that its product positions are fetched once
+        cart = context["cart"] = Cart(self.request)
+
         # Put delivery instance and delivery price into context
         if context["order"].get("delivery"):
-            cart = Cart(self.request)
             delivery_instance = Deliver.objects.get(pk=context["order"]["delivery"])
             delivery_price = cart.get_delivery_price(delivery_instance)
             total_price = cart.get_total_products_price() + delivery_price
@@ -120,9 +129,8 @@ class CheckoutView(BaseMixin, FormView):
 
         request.session.modified = True
 
-        # Store order and cart dicts from session in the copy
+        # Store order dict from session in the copy
         order_copy = order.copy()
-        cart_copy = self.request.session[settings.CART_SESSION_ID].copy()
 
         user = None
 
@@ -158,73 +166,66 @@ class CheckoutView(BaseMixin, FormView):
 
         # We created new user, or authenticated as existing one => login:
         if user:
-            # Login user, session data will be lost
+            # Login user, session data will be lost (cart is merged into the user's cart on login)
             login(
                 self.request,
                 user,
                 backend="allauth.account.auth_backends.AuthenticationBackend",
             )
-            # Restore order and cart in session from copies
-            self.request.session[settings.CART_SESSION_ID] = cart_copy
+            # Restore order in session from copy
             self.request.session[settings.ORDER_SESSION_ID] = order_copy
             request.session.modified = True
             return redirect(reverse("orders:checkout") + "?step=2")
 
-        # Check product position availability before proceeding to the last step
+        # Hold available quantities of the cart for the buyer before proceeding to the last step
         if step == self.STEP_3_PAYMENT_OPTIONS:
-            cart = self.request.session[settings.CART_SESSION_ID]
-
-            for product_position_id in cart.keys():
-                product_position_instance = ProductPosition.objects.get(pk=product_position_id)
-                quantity = int(cart[product_position_id]["quantity"])
-                if quantity > product_position_instance.quantity:
-                    cart[product_position_id]["quantity"] = product_position_instance.quantity
+            cart = Cart(self.request)
+            if not self.request.session.session_key:
+                self.request.session.save()
+            reserved_quantities = reserve_cart(self.request.session.session_key, cart.cart)
 
-            self.request.session.modified = True
+            for item in list(cart):
+                product_position_instance = item["product_position"]
+                reserved_quantity = reserved_quantities[str(product_position_instance.pk)]
+                if int(item["quantity"]) > reserved_quantity:
+                    cart.add(product_position_instance, reserved_quantity, override_quantity=True)
 
         # Handle order submit on the last step
         if step == self.STEP_4_SUBMIT_ORDER:
             # Final step - create Order, OrderItem model instances
             client = self.request.user if self.request.user.is_authenticated else None
             delivery = Deliver.objects.get(pk=order["delivery"])
-            delivery_price = Cart(self.request).get_delivery_price(delivery=delivery)
-
-            # Create Order instance
-            order_instance = Order.objects.create(
-                client=client,
-                delivery=delivery,
-                delivery_price=delivery_price,
-                payment=order["payment"],
-                status="created",
-                name=order["name"],
-                phone=order["phone"],
-                email=order["email"],
-                city=order["city"],
-                address=order["address"],
-                comment=order["comment"],
-            )
-            self.order_id = order_instance.pk
+            cart = Cart(self.request)
 
-            # Create OrderItem instances
-            cart = self.request.session[settings.CART_SESSION_ID]
-            for product_position_id in cart.keys():
-                product_position_instance = ProductPosition.objects.get(
-                    pk=product_position_id
+            # Create Order and OrderItem instances, taking ordered quantities off the stock
+            # (delivery price is calculated for the quantities actually ordered)
+            try:
+                order_instance = Order.place(
+                    cart.cart,
+                    reservation_key=self.request.session.session_key,
+                    client=client,
+                    delivery=delivery,
+                    payment=order["payment"],
+                    status="created",
+                    name=order["name"],
+                    phone=order["phone"],
+                    email=order["email"],
+                    city=order["city"],
+                    address=order["address"],
+                    comment=order["comment"],
                 )
-                quantity = int(cart[product_position_id]["quantity"])
-                price = Decimal(cart[product_position_id]["price"])
-                total_price = price * quantity
-                if quantity:
-                    OrderItem.objects.create(
-                        order=order_instance,
-                        product_position=product_position_instance,
-                        price=total_price,
-                        quantity=quantity,
-                    )
+            except OutOfStockError:
+                cart.clear()
+                return redirect("products:cart_detail")
+            self.order_id = order_instance.pk
+
+            # Count ordered products in their popularity scores
+            transaction.on_commit(
+                lambda: update_products_popularity.delay(order_instance.pk, ORDER_CREATED_WEIGHT)
+            )
 
             # Reset cart
-            self.request.session[settings.CART_SESSION_ID] = {}
-            self.request.session.modified = True
+            cart.clear()
 
         return super().post(request, *args, **kwargs)
 
@@ -245,7 +246,34 @@ class CheckoutView(BaseMixin, FormView):
         )
 
 
-class PaymentView(FormView):
+class PaymentMixin:
+    """
+    Start payment of the order once per attempt and redirect to the payment progress page.
+
+    Payment attempt is started with a conditional update of the order status, so repeated submissions
+    of the form don't enqueue more checks while the order is being paid (see `Order.start_payment`).
+    """
+
+    def get_order_id(self):
+        raise NotImplementedError
+
+    def get_success_url(self):
+        return "{url}?order_id={order_id}".format(url=reverse("orders:progress-payment"), order_id=self.get_order_id())
+
+    def form_valid(self, form):
+        order_id = self.get_order_id()
+        payment_key = Order.start_payment(order_id)
+        if payment_key:
+            enqueue_payment(order_id, payment_key, form.cleaned_data["card_number"])
+
+        # Let the payer follow the payment status
+        payment_orders = self.request.session.get(PAYMENT_ORDERS_SESSION_ID, [])
+        if order_id not in payment_orders:
+            self.request.session[PAYMENT_ORDERS_SESSION_ID] = [*payment_orders, order_id]
+        return super().form_valid(form)
+
+
+class PaymentView(PaymentMixin, FormView):
     form_class = CardNumberForm
 
     def get_template_names(self):
@@ -256,20 +284,11 @@ class PaymentView(FormView):
         else:
             return ["orders/paymentsomeone.html"]
 
-    def get_success_url(self):
-        return reverse_lazy("orders:progress-payment")
+    def get_order_id(self):
+        return int(self.request.session[settings.ORDER_SESSION_ID]["order_id"])
 
-    def post(self, request, *args, **kwargs):
-        order = self.request.session.get(settings.ORDER_SESSION_ID, "")
-        form = self.get_form()
-        if form.is_valid():
-            check_card_number.delay(self.request.POST.get("card_number", "0"), order["order_id"])
-            return self.form_valid(form)
-        else:
-            return self.form_invalid(form)
 
-
-class PaymentViewWithParams(FormView):
+class PaymentViewWithParams(PaymentMixin, FormView):
     form_class = CardNumberForm
     template_name = "orders/paymentsomeone.html"
 
@@ -278,21 +297,45 @@ class PaymentViewWithParams(FormView):
         context["order_id"] = self.kwargs["order_id"]
         return context
 
-    def get_success_url(self):
-        return reverse_lazy("orders:progress-payment")
-
-    def post(self, request, *args, **kwargs):
-        form = self.get_form()
-        if form.is_valid():
-            check_card_number.delay(self.request.POST.get("card_number", "0"), self.kwargs["order_id"])
-            return self.form_valid(form)
-        else:
-            return self.form_invalid(form)
+    def get_order_id(self):
+        return self.kwargs["order_id"]
 
 
 class ProgressPaymentView(TemplateView):
     template_name = "orders/progress-payment.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        order_id = self.request.GET.get("order_id", "")
+        if order_id.isdigit():
+            context["status_url"] = reverse("orders:payment_status", kwargs={"pk": order_id})
+        return context
+
+
+@require_GET
+@never_cache
+def payment_status(request: HttpRequest, pk: int) -> JsonResponse:
+    """
+    Return JSON with payment status of the order, polled by the payment progress page.
+    Available to the client of the order and to whoever submitted its payment in this session.
+    """
+    order = Order.objects.filter(pk=pk).values("client_id", "status", "is_paid").first()
+    if order is None:
+        raise Http404
+    is_client = order["client_id"] is not None and order["client_id"] == request.user.pk
+    if not is_client and pk not in request.session.get(PAYMENT_ORDERS_SESSION_ID, []):
+        raise Http404
+
+    return JsonResponse(
+        {
+            "order_id": pk,
+            "status": order["status"],
+            "status_display": dict(Order.STATUS_CHOICES)[order["status"]],
+            "is_paid": order["is_paid"],
+            "is_final": order["status"] != "processing",
+        }
+    )
+
 
 class OrderListView(TemplateView):
     template_name = "orders/orders.html"
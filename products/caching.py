@@ -0,0 +1,133 @@
+"""
+Contains version stamps for data of `products` app and cache key builders depending on them.
+
+Version stamps are bumped on writes (see `products.signals`), so cached entries keyed on them
+are invalidated precisely, instead of waiting for their timeout.
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.http import QueryDict
+
+from products.discounts import offer_index
+
+VERSION_PRODUCTS = "products"
+VERSION_POSITIONS = "positions"
+VERSION_SUGGESTIONS = "suggestions"
+VERSION_CATEGORIES = "categories"
+VERSION_POPULARITY = "popularity"
+
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# GET parameters of the catalog which affect listed products
+CATALOG_PARAMS = (
+    "price",
+    "sort_param",
+    "tags",
+    "category",
+    "seller",
+    "feature",
+    "in_stock",
+    "free_shipping",
+    "product_name",
+    "query",
+    "page",
+    "pagination",
+    "cursor",
+)
+
+# GET parameters of the catalog which affect only the order or the page of listed products
+CATALOG_PAGE_PARAMS = ("sort_param", "page", "pagination", "cursor")
+
+# Values of "sort_param" ordering the catalog by popularity scores
+POPULARITY_SORT_PARAMS = ("pop_l2h", "pop_h2l")
+
+
+def get_version_cache_key(name: str) -> str:
+    return f"version_{name}"
+
+
+def get_initial_version() -> int:
+    """
+    Return version for a stamp missing from the cache (never set, evicted or flushed).
+    It's based on the current time, so it differs from versions seen by processes before the stamp was lost.
+    """
+    return time.time_ns() // 1000
+
+
+def get_versions(*names: str) -> list:
+    """Return current versions for given names."""
+    keys = [get_version_cache_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: get_initial_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            # Another process could set the stamp meanwhile, keep its value
+            cache.add(key, version, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names: str) -> None:
+    """Increment versions for given names, invalidating all cache entries depending on them."""
+    for name in names:
+        key = get_version_cache_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, get_initial_version(), timeout=None)
+
+
+def get_catalog_version() -> str:
+    """Return combined version of products, product positions and offers."""
+    products_version, positions_version = get_versions(VERSION_PRODUCTS, VERSION_POSITIONS)
+    return f"{products_version}.{positions_version}.{offer_index.version}"
+
+
+def normalize_catalog_params(query_dict: QueryDict) -> dict:
+    """
+    Return catalog GET parameters affecting listed products, with empty values dropped
+    and multiple values sorted, so that equivalent query strings give equal results.
+    """
+    params = {}
+    for name in CATALOG_PARAMS:
+        values = sorted({value.strip() for value in query_dict.getlist(name) if value.strip()})
+        if values:
+            params[name] = values
+    return params
+
+
+def get_params_hash(params: dict) -> str:
+    params = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(params.encode()).hexdigest()
+
+
+def get_catalog_cache_key(query_dict: QueryDict) -> str:
+    """Return cache key of rendered catalog content for given GET parameters."""
+    params_hash = get_params_hash(normalize_catalog_params(query_dict))
+    version = get_catalog_version()
+    if query_dict.get("sort_param") in POPULARITY_SORT_PARAMS:
+        # Scores change with every order, but only listings sorted by them depend on that
+        (popularity_version,) = get_versions(VERSION_POPULARITY)
+        version = f"{version}.{popularity_version}"
+    return f"catalog_{version}_{params_hash}"
+
+
+def get_catalog_filters_hash(query_dict: QueryDict) -> str:
+    """Return hash of catalog GET parameters filtering products, regardless of their order and page."""
+    params = normalize_catalog_params(query_dict)
+    for name in CATALOG_PAGE_PARAMS:
+        params.pop(name, None)
+    return get_params_hash(params)
+
+
+def get_catalog_facets_cache_key(query_dict: QueryDict) -> str:
+    """Return cache key of catalog facet counts for given GET parameters."""
+    return f"catalog_facets_{get_catalog_version()}_{get_catalog_filters_hash(query_dict)}"
+
+
+def get_catalog_count_cache_key(query_dict: QueryDict) -> str:
+    """Return cache key of the total count of catalog products for given GET parameters."""
+    return f"catalog_count_{get_catalog_version()}_{get_catalog_filters_hash(query_dict)}"
@@ -1,26 +1,26 @@
 from decimal import Decimal
 
-from django.conf import settings
 from django.http import HttpRequest
 
 from orders.models import Deliver
+from products.cart_storage import get_cart_storage_class
+from products.discounts import DiscountResolver
 from products.models import ProductPosition
+from products.reservations import release_reservations
 
 
 class Cart:
     """
-    Describes shopping cart in eshop as `cart` dictionary in the session.
+    Describes shopping cart in eshop. Cart lines are kept by the storage backend set with `CART_STORAGE` setting
+    (in the session by default), see `products.cart_storage`.
     """
 
     def __init__(self, request: HttpRequest):
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-
-        if not cart:
-            # Create an empty cart
-            cart = self.session[settings.CART_SESSION_ID] = {}
-
-        self.cart = cart
+        self.storage = get_cart_storage_class()(request)
+        self.cart = self.storage.get_lines()
+        # Cart items with product positions, fetched once and reset on cart changes
+        self._items = None
 
     def add(
         self,
@@ -40,29 +40,22 @@ class Cart:
         """
         product_position_id = str(product_position.id)
 
-        if product_position_id not in self.cart:
+        if product_position_id in self.cart:
+            price = self.cart[product_position_id]["price"]
+        else:
             # NB: we store price with discount (if any) applied
-            self.cart[product_position_id] = {
-                "quantity": 0,
-                "price": str(product_position.get_price_with_discount()),
-            }
+            price = str(DiscountResolver.for_positions([product_position]).get_price_with_discount(product_position))
 
-        if override_quantity:
-            self.cart[product_position_id]["quantity"] = quantity
+        quantity = self.storage.add_line(product_position_id, quantity, price, override_quantity)
+        self._items = None
+        if quantity:
+            self.cart[product_position_id] = {"quantity": quantity, "price": price}
         else:
-            self.cart[product_position_id]["quantity"] += quantity
-
-        if self.cart[product_position_id]["quantity"] == 0:
-            del self.cart[product_position_id]
-
-        self.save()
+            self.cart.pop(product_position_id, None)
 
     def save(self):
-        """
-        Mark the session as "modified" to make sure it gets saved.
-        Reference: https://docs.djangoproject.com/en/4.2/topics/http/sessions/#when-sessions-are-saved
-        """
-        self.session.modified = True
+        """Make sure changes of the cart lines are saved by the storage."""
+        self.storage.save()
 
     def remove(self, product_position: ProductPosition):
         """
@@ -73,48 +66,79 @@ class Cart:
         product_position_id = str(product_position.id)
 
         if product_position_id in self.cart:
-            del self.cart[product_position_id]
-            self.save()
+            self.storage.remove_line(product_position_id)
+            self.cart.pop(product_position_id, None)
+            self._items = None
+
+    def clear(self):
+        """Remove all product positions from the cart and release stock held for them."""
+        self.storage.clear()
+        if self.session.session_key:
+            release_reservations(self.session.session_key)
+        self.cart = {}
+        self._items = None
+
+    def get_items(self) -> list:
+        """
+        Return the items in the cart with their product positions, prices converted from str back to decimal,
+        and total price of each position.
+
+        Product positions are fetched with their products, sellers and product images in a constant number
+        of queries, once per cart instance. Lines of product positions that no longer exist are left out.
+        Cart lines themselves are not changed, so the stored cart keeps only serializable values.
+        """
+        if self._items is None:
+            product_positions = {}
+            if self.cart:
+                product_positions = {
+                    str(product_position.id): product_position
+                    for product_position in ProductPosition.objects.filter(id__in=self.cart.keys())
+                    .select_related("product", "seller")
+                    .prefetch_related("product__images")
+                }
+
+            self._items = []
+            for product_position_id, line in self.cart.items():
+                product_position = product_positions.get(product_position_id)
+                if product_position is None:
+                    continue
+                price = Decimal(line["price"])
+                self._items.append(
+                    {
+                        "product_position": product_position,
+                        "quantity": line["quantity"],
+                        "price": price,
+                        "total_price": price * line["quantity"],
+                    }
+                )
+        return self._items
 
     def __iter__(self):
         """
-        Iterate over the items in the cart and get the product positions from the database.
+        Iterate over the items in the cart with product positions from the database.
         """
-        product_position_ids = self.cart.keys()
-        product_positions = ProductPosition.objects.filter(
-            id__in=product_position_ids
-        ).select_related("product")
-        cart = self.cart.copy()
-
-        # Add database model instances to the cart
-        for product_position in product_positions:
-            cart[str(product_position.id)]["product_position"] = product_position
-
-        # Iterate over the items in the cart, converting prices from str back to decimal,
-        # and calculate total price for each position.
-        for item in cart.values():
-            item["price"] = Decimal(item["price"])
-            item["total_price"] = item["price"] * item["quantity"]
-            yield item
+        return iter(self.get_items())
 
     def __len__(self):
         """
         Count all items (i.e., sum all quantities of items) in the cart.
         """
-        return sum(item["quantity"] for item in self.cart.values())
+        return self.item_count
+
+    @property
+    def item_count(self) -> int:
+        """Return number of products in the cart, counted from the cart lines without fetching product positions."""
+        return sum(int(item["quantity"]) for item in self.cart.values())
 
     def get_delivery_price(self, delivery: Deliver):
         """Return delivery price taking into account delivery type, number of sellers and total price."""
-        products_price = self.get_total_products_price()
-        sellers_qty = len(set([item["product_position"].seller.pk for item in self]))
-
-        if not delivery.is_express:
-            if products_price < delivery.free_threshold or sellers_qty > 1:
-                return delivery.price
-            if products_price > delivery.free_threshold and sellers_qty == 1:
-                return 0
-
-        return delivery.price
+        # Count total price and sellers in one pass over the items
+        products_price = 0
+        sellers = set()
+        for item in self.get_items():
+            products_price += item["total_price"]
+            sellers.add(item["product_position"].seller_id)
+        return delivery.get_price(products_price, len(sellers))
 
     def get_total_products_price(self):
         """
@@ -0,0 +1,139 @@
+"""
+Contains storage backends of the shopping cart.
+
+Backend is chosen with `CART_STORAGE` setting (dotted path to the class):
+- `SessionCartStorage` (default) keeps the cart in the session;
+- `DatabaseCartStorage` keeps carts of authenticated users in `CartItem` table, so that cart writes
+  don't rewrite the session and carts are shared between devices. Anonymous carts are kept in the session
+  and merged into the user's cart at login.
+
+Cart lines are dicts `{"<product position id>": {"quantity": <int>, "price": "<price with discount>"}}`.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from products.models import CartItem
+
+
+class SessionCartStorage:
+    """Keeps cart lines in the session."""
+
+    def __init__(self, request: HttpRequest):
+        self.session = request.session
+
+    def get_lines(self) -> dict:
+        """Return cart lines, without creating an empty cart in the session."""
+        return self.session.get(settings.CART_SESSION_ID) or {}
+
+    def add_line(self, product_position_id: str, quantity: int, price: str, override_quantity: bool) -> int:
+        """Add quantity to the line (or set it), creating the line if needed; return resulting quantity."""
+        lines = self.session.get(settings.CART_SESSION_ID)
+        if not lines:
+            lines = self.session[settings.CART_SESSION_ID] = {}
+        line = lines.setdefault(product_position_id, {"quantity": 0, "price": price})
+        line["quantity"] = quantity if override_quantity else line["quantity"] + quantity
+        if line["quantity"] <= 0:
+            del lines[product_position_id]
+        self.save()
+        return max(line["quantity"], 0)
+
+    def remove_line(self, product_position_id: str) -> None:
+        lines = self.session.get(settings.CART_SESSION_ID) or {}
+        if product_position_id in lines:
+            del lines[product_position_id]
+            self.save()
+
+    def clear(self) -> None:
+        if self.session.get(settings.CART_SESSION_ID):
+            self.session[settings.CART_SESSION_ID] = {}
+            self.save()
+
+    def save(self) -> None:
+        """
+        Mark the session as "modified" to make sure it gets saved.
+        Reference: https://docs.djangoproject.com/en/4.2/topics/http/sessions/#when-sessions-are-saved
+        """
+        self.session.modified = True
+
+    @classmethod
+    def merge_anonymous_cart(cls, request: HttpRequest, user) -> None:
+        """Nothing to merge: session data of anonymous user is kept at login."""
+
+
+class DatabaseCartStorage(SessionCartStorage):
+    """
+    Keeps cart lines of authenticated users in `CartItem` table, one row per line.
+    Quantities are incremented atomically with `F()` expressions, so concurrent requests don't lose updates.
+    """
+
+    def __init__(self, request: HttpRequest):
+        super().__init__(request)
+        self.user = request.user if request.user.is_authenticated else None
+
+    def get_lines(self) -> dict:
+        if self.user is None:
+            return super().get_lines()
+        return {
+            str(product_position_id): {"quantity": quantity, "price": str(price)}
+            for product_position_id, quantity, price in CartItem.objects.filter(user=self.user).values_list(
+                "product_position_id", "quantity", "price"
+            )
+        }
+
+    def add_line(self, product_position_id: str, quantity: int, price: str, override_quantity: bool) -> int:
+        if self.user is None:
+            return super().add_line(product_position_id, quantity, price, override_quantity)
+        return self.add_user_line(self.user, product_position_id, quantity, price, override_quantity)
+
+    @staticmethod
+    def add_user_line(user, product_position_id, quantity: int, price: str, override_quantity: bool) -> int:
+        lines = CartItem.objects.filter(user=user, product_position_id=product_position_id)
+        with transaction.atomic():
+            # Quantity can't go below zero (lines with zero quantity are deleted below)
+            new_quantity = max(quantity, 0) if override_quantity else Greatest(F("quantity") + quantity, 0)
+            if not lines.update(quantity=new_quantity):
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(
+                            user=user,
+                            product_position_id=product_position_id,
+                            quantity=max(quantity, 0),
+                            price=price,
+                        )
+                except IntegrityError:
+                    # The line was created by a concurrent request
+                    lines.update(quantity=new_quantity)
+
+            line_quantity = lines.values_list("quantity", flat=True).first() or 0
+            if line_quantity <= 0:
+                lines.delete()
+        return max(line_quantity, 0)
+
+    def remove_line(self, product_position_id: str) -> None:
+        if self.user is None:
+            return super().remove_line(product_position_id)
+        CartItem.objects.filter(user=self.user, product_position_id=product_position_id).delete()
+
+    def clear(self) -> None:
+        if self.user is None:
+            return super().clear()
+        CartItem.objects.filter(user=self.user).delete()
+
+    @classmethod
+    def merge_anonymous_cart(cls, request: HttpRequest, user) -> None:
+        """Move lines of the anonymous cart from the session into the user's cart, adding up quantities."""
+        lines = request.session.get(settings.CART_SESSION_ID)
+        if not lines:
+            return
+        for product_position_id, line in lines.items():
+            cls.add_user_line(user, product_position_id, int(line["quantity"]), line["price"], False)
+        request.session[settings.CART_SESSION_ID] = {}
+        request.session.modified = True
+
+
+def get_cart_storage_class():
+    return import_string(getattr(settings, "CART_STORAGE", "products.cart_storage.SessionCartStorage"))
@@ -0,0 +1,140 @@
+"""
+Contains category tree cached in Django cache and in process, used to render the categories menu
+and to find subcategories without querying the database.
+"""
+import threading
+from typing import Optional
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from products.caching import VERSION_CATEGORIES, get_versions
+from products.models import Category
+
+
+class CategoryNode:
+    """Category of the tree with links to its children and sets of its ancestor and descendant ids."""
+
+    __slots__ = (
+        "id", "title", "parent_id", "image", "is_chosen", "path", "depth", "children", "ancestors", "descendant_ids"
+    )
+
+    def __init__(self, id: int, title: str, parent_id: Optional[int], image: str, is_chosen: bool, path: str):
+        self.id = id
+        self.title = title
+        self.parent_id = parent_id
+        self.image = image
+        self.is_chosen = is_chosen
+        self.path = path
+        self.depth = 0
+        self.children = []
+        # From the root down to the parent
+        self.ancestors = []
+        # Ids of the category itself and all its subcategories of any depth
+        self.descendant_ids = frozenset()
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+    @property
+    def image_url(self) -> str:
+        return default_storage.url(self.image) if self.image else ""
+
+    @property
+    def path_title(self) -> str:
+        """Return titles of the category and its ancestors, e.g. "Электроника / Телевизоры"."""
+        return " / ".join([*(ancestor.title for ancestor in self.ancestors), self.title])
+
+    def __str__(self):
+        return self.path_title
+
+
+class CategoryTree:
+    """
+    Tree of not deleted categories.
+
+    Categories are fetched with one query, which result is shared through Django cache, and the tree
+    is kept in process until categories version is bumped on `Category` writes (see `products.signals`).
+    """
+
+    CACHE_KEY_PREFIX = "category_tree"
+    # Rows of outdated versions are not needed anymore, let them expire
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._nodes = {}
+        self._roots = []
+
+    def _fetch_rows(self, version) -> list:
+        cache_key = f"{self.CACHE_KEY_PREFIX}_{version}"
+        rows = cache.get(cache_key)
+        if rows is None:
+            rows = list(
+                Category.objects.filter(is_deleted=False)
+                .order_by("pk")
+                .values_list("id", "title", "parent_id", "image", "is_chosen", "path")
+            )
+            cache.set(cache_key, rows, self.CACHE_TIMEOUT)
+        return rows
+
+    def _build(self, version) -> None:
+        nodes = {row[0]: CategoryNode(*row) for row in self._fetch_rows(version)}
+        roots = []
+        for node in nodes.values():
+            parent = nodes.get(node.parent_id)
+            if parent is not None:
+                parent.children.append(node)
+            elif node.parent_id is None:
+                roots.append(node)
+
+        # Walk from the roots down, so that categories under deleted ones are left out
+        reachable = {}
+
+        def walk(node, ancestors) -> frozenset:
+            reachable[node.id] = node
+            node.depth = len(ancestors)
+            node.ancestors = ancestors
+            descendant_ids = {node.id}
+            for child in node.children:
+                descendant_ids |= walk(child, [*ancestors, node])
+            node.descendant_ids = frozenset(descendant_ids)
+            return node.descendant_ids
+
+        for root in roots:
+            walk(root, [])
+
+        self._nodes = reachable
+        self._roots = roots
+        self._version = version
+
+    def _ensure_fresh(self) -> None:
+        (version,) = get_versions(VERSION_CATEGORIES)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+
+    @property
+    def roots(self) -> list:
+        """Return top level categories."""
+        self._ensure_fresh()
+        return self._roots
+
+    def get(self, category_id) -> Optional[CategoryNode]:
+        """Return category with given id or None if there's no such category or it's deleted."""
+        self._ensure_fresh()
+        return self._nodes.get(category_id)
+
+    def iter_nodes(self):
+        """Iterate over all categories depth-first, so that subcategories follow their parent."""
+        stack = list(reversed(self.roots))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+category_tree = CategoryTree()
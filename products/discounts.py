@@ -0,0 +1,207 @@
+"""
+Contains in-process index of active offers and DiscountResolver to price whole lists of products
+and product positions without querying offers for each of them.
+"""
+import threading
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+from django.db.models import Q, prefetch_related_objects
+
+from products.models import Category, Offer, Product, ProductPosition
+
+
+class ActiveOfferIndex:
+    """
+    In-memory index of active offers keyed by product id and category id, ordered by priority.
+    Offers linked to a category are indexed for all its subcategories as well.
+
+    The index is rebuilt lazily on first access after it was invalidated: either `invalidate()` was called
+    (on `Offer` writes, see `products.signals`), or the date changed since the last build
+    (`date_start`/`date_end` boundary at midnight).
+    Invalidation counter is kept in Django cache, so all processes sharing the cache rebuild their indexes.
+    """
+
+    VERSION_CACHE_KEY = "active_offer_index_version"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_on = None
+        self._built_version = None
+        self._offers = ()
+        self._by_product = {}
+        self._by_category = {}
+
+    @classmethod
+    def _get_shared_version(cls) -> int:
+        from products.caching import get_initial_version
+
+        version = cache.get(cls.VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(cls.VERSION_CACHE_KEY, get_initial_version(), timeout=None)
+            version = cache.get(cls.VERSION_CACHE_KEY)
+        return version
+
+    def invalidate(self) -> None:
+        """Mark index as outdated in all processes."""
+        from products.caching import get_initial_version
+
+        try:
+            cache.incr(self.VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(self.VERSION_CACHE_KEY, get_initial_version(), timeout=None)
+        self._built_version = None
+
+    def reload(self) -> None:
+        """Rebuild index in the current process right away."""
+        with self._lock:
+            self._build(self._get_shared_version())
+
+    def _ensure_fresh(self) -> None:
+        shared_version = self._get_shared_version()
+        if self._built_on == date.today() and self._built_version == shared_version:
+            return
+        with self._lock:
+            if self._built_on != date.today() or self._built_version != shared_version:
+                self._build(shared_version)
+
+    def _build(self, shared_version: int) -> None:
+        """
+        Fetch active offers with their product and category links and subcategories of linked categories
+        (4 queries) and swap the index.
+        """
+        built_on = date.today()
+        offers = {offer.pk: offer for offer in Offer.get_active_offers()}
+        by_product = defaultdict(list)
+        by_category = defaultdict(list)
+
+        if offers:
+            product_links = Offer.products.through.objects.filter(
+                offer_id__in=offers.keys(),
+            ).values_list("offer_id", "product_id")
+            for offer_id, product_id in product_links:
+                by_product[product_id].append(offers[offer_id])
+
+            offers_by_category_path = defaultdict(list)
+            category_links = Offer.categories.through.objects.filter(
+                offer_id__in=offers.keys(),
+            ).values_list("offer_id", "category_id", "category__path")
+            for offer_id, category_id, category_path in category_links:
+                if category_path:
+                    offers_by_category_path[category_path].append(offers[offer_id])
+                else:
+                    # Path is not filled yet, apply the offer to the category itself only
+                    by_category[category_id].append(offers[offer_id])
+
+            # Offers of a category apply to all its subcategories too
+            if offers_by_category_path:
+                subtrees = reduce(or_, (Q(path__startswith=path) for path in offers_by_category_path))
+                for category_id, category_path in Category.objects.filter(subtrees).values_list("pk", "path"):
+                    category_offers = {}
+                    for path in self._get_path_prefixes(category_path):
+                        category_offers.update((offer.pk, offer) for offer in offers_by_category_path.get(path, ()))
+                    by_category[category_id] = list(category_offers.values())
+
+        def by_priority(offer):
+            return -offer.priority
+
+        self._offers = tuple(offers.values())
+        self._by_product = {key: tuple(sorted(value, key=by_priority)) for key, value in by_product.items()}
+        self._by_category = {key: tuple(sorted(value, key=by_priority)) for key, value in by_category.items()}
+        self._built_on = built_on
+        self._built_version = shared_version
+
+    @staticmethod
+    def _get_path_prefixes(path: str) -> list:
+        """Return materialized paths of the category and all its ancestors: "3/12/" -> ["3/", "3/12/"]."""
+        category_ids = path.split(Category.PATH_SEPARATOR)[:-1]
+        return [
+            "".join(f"{category_id}{Category.PATH_SEPARATOR}" for category_id in category_ids[:length])
+            for length in range(1, len(category_ids) + 1)
+        ]
+
+    @property
+    def version(self) -> str:
+        """Version of active offers set; use it as a part of cache keys depending on discounts."""
+        self._ensure_fresh()
+        return f"{self._built_version}-{self._built_on:%Y%m%d}"
+
+    def get_offers(self) -> tuple:
+        """Return all active offers, newest first."""
+        self._ensure_fresh()
+        return self._offers
+
+    def get_top_offer(self, product_id: int, category_id: int) -> Optional[Offer]:
+        """Return applicable offer with top priority for the product with given id and category id."""
+        self._ensure_fresh()
+        product_offers = self._by_product.get(product_id)
+        category_offers = self._by_category.get(category_id)
+        candidates = [offers[0] for offers in (product_offers, category_offers) if offers]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda offer: offer.priority)
+
+
+offer_index = ActiveOfferIndex()
+
+
+def get_offers_product_ids(offer_ids) -> set:
+    """Return ids of all products affected by offers: linked directly or via category or its parent categories."""
+    category_paths = Category.objects.filter(offers__in=offer_ids).exclude(path="").values_list("path", flat=True)
+    condition = reduce(or_, (Q(category__path__startswith=path) for path in category_paths), Q(offers__in=offer_ids))
+    return set(Product.objects.filter(condition).values_list("pk", flat=True).distinct())
+
+
+class DiscountResolver:
+    """
+    Resolve prices with discount for any number of products and product positions in memory,
+    using active offers from `offer_index`.
+
+    Usage:
+        resolver = DiscountResolver(products)
+        resolver.annotate_products()
+        price = resolver.get_price_with_discount(product_position)
+    """
+
+    def __init__(self, products: Iterable[Product]):
+        self.products = list(products)
+
+    @classmethod
+    def for_positions(cls, product_positions: Iterable[ProductPosition]) -> "DiscountResolver":
+        """Create resolver for products of given product positions (`product` should be selected already)."""
+        products = {position.product_id: position.product for position in product_positions}
+        return cls(products.values())
+
+    def get_top_offer(self, product: Product) -> Optional[Offer]:
+        """Return applicable offer with top priority for the product."""
+        return offer_index.get_top_offer(product.pk, product.category_id)
+
+    def get_price_with_discount(self, product_position: ProductPosition) -> Decimal:
+        """Return product position price with top priority discount applied."""
+        top_offer = self.get_top_offer(product_position.product)
+        return Offer.apply_offer(top_offer, product_position.price)
+
+    def annotate_products(self) -> list:
+        """
+        Set `avg_price` and `avg_price_with_discount` attributes on every product,
+        so templates don't have to query them card by card.
+        Product positions are fetched with a single query for all products.
+        """
+        prefetch_related_objects(self.products, "productposition_set")
+        for product in self.products:
+            positions = product.productposition_set.all()
+            if not positions:
+                product.avg_price = product.avg_price_with_discount = None
+                continue
+
+            top_offer = self.get_top_offer(product)
+            product.avg_price = round(sum(position.price for position in positions) / len(positions), 2)
+            prices_with_discount = [Offer.apply_offer(top_offer, position.price) for position in positions]
+            avg_price_with_discount = round(sum(prices_with_discount) / len(prices_with_discount), 2)
+            product.avg_price_with_discount = max(avg_price_with_discount, 1)
+        return self.products
@@ -0,0 +1,177 @@
+"""
+Contains faceted filtering for the catalog: multi-select tags, categories (with subcategories),
+sellers and feature keys, with counts of products for every facet value.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Count, Q, QuerySet
+from django.http import QueryDict
+
+from products.categories import category_tree
+from products.models import Product, ProductPosition, Seller, Tag
+
+
+class CatalogFacets:
+    """
+    Parses selected facet values from GET parameters, filters products by them and counts products
+    for every facet value.
+
+    Values of one facet are combined with OR, different facets are combined with AND.
+    Counts for each facet are calculated for the products filtered by all other facets,
+    so that every facet needs a single GROUP BY query regardless of the number of its values.
+    """
+
+    TAGS = "tags"
+    CATEGORY = "category"
+    SELLER = "seller"
+    FEATURE = "feature"
+    FACET_TITLES = {
+        CATEGORY: "Категории",
+        TAGS: "Тэги",
+        SELLER: "Продавцы",
+        FEATURE: "Характеристики",
+    }
+
+    def __init__(self, query_dict: QueryDict):
+        self.selected = {
+            self.TAGS: self._get_ids(query_dict.getlist(self.TAGS)),
+            self.CATEGORY: self._get_ids(query_dict.getlist(self.CATEGORY)),
+            self.SELLER: self._get_ids(query_dict.getlist(self.SELLER)),
+            self.FEATURE: [key for key in query_dict.getlist(self.FEATURE) if key],
+        }
+
+    @staticmethod
+    def _get_ids(values) -> list:
+        return [int(value) for value in values if value.isdigit()]
+
+    def filter(self, queryset: QuerySet, exclude: str = None) -> QuerySet:
+        """Filter products by all selected facet values, except the values of `exclude` facet."""
+        tag_ids = self.selected[self.TAGS]
+        if tag_ids and exclude != self.TAGS:
+            queryset = queryset.filter(
+                pk__in=Product.tags.through.objects.filter(tag_id__in=tag_ids).values("product_id")
+            )
+
+        category_ids = self.selected[self.CATEGORY]
+        if category_ids and exclude != self.CATEGORY:
+            # Products of selected categories and their subcategories, matched by materialized paths
+            # (an empty path of a category not filled yet would match all products)
+            nodes = [node for node in map(category_tree.get, category_ids) if node is not None]
+            category_paths = {node.path for node in nodes if node.path}
+            queryset = queryset.filter(
+                reduce(or_, (Q(category__path__startswith=path) for path in category_paths), Q(pk__in=[]))
+            )
+
+        seller_ids = self.selected[self.SELLER]
+        if seller_ids and exclude != self.SELLER:
+            queryset = queryset.filter(
+                pk__in=ProductPosition.objects.filter(seller_id__in=seller_ids).values("product_id")
+            )
+
+        feature_keys = self.selected[self.FEATURE]
+        if feature_keys and exclude != self.FEATURE:
+            queryset = queryset.filter(features__has_any_keys=feature_keys)
+
+        return queryset
+
+    def get_counts(self, queryset: QuerySet) -> dict:
+        """
+        Return dict with list of values for every facet. Each value is a dict with `id`, `title`, `count`
+        and `selected` keys (categories also have `depth`).
+
+        :param queryset: products filtered by everything except facets.
+        """
+        return {
+            self.TAGS: self._get_tag_counts(self._get_product_ids(queryset, self.TAGS)),
+            self.CATEGORY: self._get_category_counts(self._get_product_ids(queryset, self.CATEGORY)),
+            self.SELLER: self._get_seller_counts(self._get_product_ids(queryset, self.SELLER)),
+            self.FEATURE: self._get_feature_counts(self._get_product_ids(queryset, self.FEATURE)),
+        }
+
+    def _get_product_ids(self, queryset: QuerySet, facet: str) -> QuerySet:
+        """Return subquery of ids of products filtered by all facets except given one."""
+        return self.filter(queryset, exclude=facet).order_by().values("pk")
+
+    def _make_value(self, facet: str, value_id, title: str, count: int) -> dict:
+        return {
+            "id": value_id,
+            "title": title,
+            "count": count,
+            "selected": value_id in self.selected[facet],
+        }
+
+    def _add_missing_selected(self, facet: str, values: list, queryset: QuerySet) -> list:
+        """Add selected values without products to the list, so that they could be unchecked."""
+        listed_ids = {value["id"] for value in values}
+        missing_ids = [value_id for value_id in self.selected[facet] if value_id not in listed_ids]
+        if missing_ids:
+            missing_values = queryset.filter(pk__in=missing_ids).values_list("pk", "title")
+            values.extend(self._make_value(facet, *value, 0) for value in missing_values)
+        return values
+
+    def _get_tag_counts(self, product_ids: QuerySet) -> list:
+        counts = (
+            Product.tags.through.objects.filter(product_id__in=product_ids)
+            .values_list("tag_id", "tag__title")
+            .annotate(count=Count("product_id"))
+            .order_by("tag__title")
+        )
+        values = [self._make_value(self.TAGS, *count) for count in counts]
+        return self._add_missing_selected(self.TAGS, values, Tag.objects.all())
+
+    def _get_category_counts(self, product_ids: QuerySet) -> list:
+        counts = dict(
+            Product.objects.filter(pk__in=product_ids)
+            .values_list("category_id")
+            .annotate(count=Count("pk"))
+            .order_by()
+        )
+
+        # Categories are listed depth-first, so that subcategories follow their parent,
+        # and parent counts include products of subcategories
+        values = []
+        for node in category_tree.iter_nodes():
+            value = self._make_value(
+                self.CATEGORY,
+                node.id,
+                node.title,
+                sum(counts.get(category_id, 0) for category_id in node.descendant_ids),
+            )
+            value["depth"] = node.depth
+            values.append(value)
+        return [value for value in values if value["count"] or value["selected"]]
+
+    def _get_seller_counts(self, product_ids: QuerySet) -> list:
+        counts = (
+            ProductPosition.objects.filter(product_id__in=product_ids)
+            .values_list("seller_id", "seller__title")
+            .annotate(count=Count("product_id", distinct=True))
+            .order_by("seller__title")
+        )
+        values = [self._make_value(self.SELLER, *count) for count in counts]
+        return self._add_missing_selected(self.SELLER, values, Seller.objects.all())
+
+    def _get_feature_counts(self, product_ids: QuerySet) -> list:
+        product_ids_sql, params = product_ids.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT feature_key, COUNT(*) FROM {Product._meta.db_table} AS product
+                CROSS JOIN LATERAL jsonb_object_keys(
+                    CASE WHEN jsonb_typeof(product.features) = 'object' THEN product.features ELSE '{{}}' END
+                ) AS feature_key
+                WHERE product.id IN ({product_ids_sql})
+                GROUP BY feature_key
+                ORDER BY feature_key
+                """,
+                params,
+            )
+            counts = cursor.fetchall()
+        values = [self._make_value(self.FEATURE, key, key, count) for key, count in counts]
+        listed_keys = {value["id"] for value in values}
+        values.extend(
+            self._make_value(self.FEATURE, key, key, 0) for key in self.selected[self.FEATURE] if key not in listed_keys
+        )
+        return values
@@ -0,0 +1,84 @@
+"""
+Contains memoized existence check of storage-backed image files, so that rendering image URLs
+doesn't hit the storage on every page view.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.core.cache import cache
+
+
+class ImageURLCache:
+    """
+    Cache of image URLs by storage file names: URL if the file exists, empty string if it doesn't.
+
+    Lookups go to a bounded in-process LRU first, then to Django cache shared by all workers,
+    and only then to the storage. Missing files are remembered for `missing_timeout` seconds only,
+    so files uploaded later are picked up. Entries are invalidated by `ProductImage` writes
+    (see `products.signals`); in-process entries of other workers expire after `local_timeout` seconds.
+    """
+
+    CACHE_KEY_PREFIX = "image_url"
+
+    def __init__(self, max_size: int = 1024, timeout: int = 60 * 60 * 24, missing_timeout: int = 60,
+                 local_timeout: int = 60):
+        """
+        :param max_size: maximum number of entries kept in process.
+        :param timeout: number of seconds URLs of existing files are kept in Django cache.
+        :param missing_timeout: number of seconds missing files are remembered.
+        :param local_timeout: number of seconds entries are kept in process.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.missing_timeout = missing_timeout
+        self.local_timeout = local_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_cache_key(self, name: str) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_{name}"
+
+    def _get_local(self, name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return url
+
+    def _set_local(self, name: str, url: str, timeout: int) -> None:
+        with self._lock:
+            self._entries[name] = (url, time.monotonic() + min(timeout, self.local_timeout))
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_url(self, image) -> Optional[str]:
+        """Return URL of the image field file if the file exists in the storage, otherwise None."""
+        name = image.name
+        if not name:
+            return None
+
+        url = self._get_local(name)
+        if url is None:
+            url = cache.get(self.get_cache_key(name))
+            if url is None:
+                url = image.url if image.storage.exists(name) else ""
+                cache.set(self.get_cache_key(name), url, self.timeout if url else self.missing_timeout)
+            self._set_local(name, url, self.timeout if url else self.missing_timeout)
+        return url or None
+
+    def invalidate(self, name: str) -> None:
+        """Forget whether the file with given name exists."""
+        with self._lock:
+            self._entries.pop(name, None)
+        cache.delete(self.get_cache_key(name))
+
+
+image_url_cache = ImageURLCache()
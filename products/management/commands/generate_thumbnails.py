@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from products.models import AdBanner, ProductImage, Seller
+from products.thumbnails import generate_thumbnails
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Generate missing thumbnails of all uploaded images.
+    """
+
+    help = """
+    Создаёт недостающие уменьшенные копии изображений товаров, баннеров, продавцов и пользователей.
+    В обычном режиме они создаются в фоне после загрузки изображения.
+    """
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        generated_count = 0
+        for model in (ProductImage, AdBanner, Seller, CustomUser):
+            names = model.objects.exclude(image="").values_list("image", flat=True).distinct()
+            for name in names.iterator():
+                generated_count += len(generate_thumbnails(name))
+
+        print("Создано уменьшенных копий изображений:", generated_count)
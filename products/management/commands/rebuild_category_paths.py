@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Category
+
+
+class Command(BaseCommand):
+    """
+    Rebuild materialized paths of all categories.
+    """
+
+    help = """
+    Пересчитывает пути категорий в дереве (`Category.path` и `Category.depth`) по родительским категориям.
+    В обычном режиме пути обновляются при сохранении категорий, в том числе загруженных через loaddata.
+    """
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        updated_qty = Category.rebuild_paths()
+        print("Обновлено путей категорий:", updated_qty)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from products.popularity import rebuild_popularity
+
+
+class Command(BaseCommand):
+    """
+    Recalculate popularity scores of all products from order items.
+    """
+
+    help = """
+    Полностью пересчитывает популярность товаров (`Product.popularity`) по всем позициям заказов
+    с учётом давности заказов. В обычном режиме популярность обновляется фоновыми задачами
+    при оформлении и оплате заказов.
+    """
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        updated_qty = rebuild_popularity()
+        print("Пересчитана популярность товаров:", updated_qty)
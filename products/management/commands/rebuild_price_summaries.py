@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product, ProductPriceSummary
+
+
+class Command(BaseCommand):
+    """
+    Rebuild price summaries for all products.
+    """
+
+    help = """
+    Полностью пересчитывает сводки цен (`ProductPriceSummary`) для всех товаров: минимальную, максимальную
+    и среднюю цены, среднюю цену со скидкой, общее количество на складах, самую дешёвую позицию
+    и наличие бесплатной доставки. Сводки товаров со скидками, которые начинают или заканчивают действовать,
+    пересчитываются после полуночи периодической задачей `refresh_offers_price_summaries`.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Количество товаров, обрабатываемых за один запрос.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        chunk_size = options["chunk_size"]
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(product_ids), chunk_size):
+            ProductPriceSummary.refresh_for_products(product_ids[start:start + chunk_size])
+
+        print("Пересчитано сводок цен:", len(product_ids))
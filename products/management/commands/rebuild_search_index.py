@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    """
+    Rebuild full-text search documents for all products.
+    """
+
+    help = """
+    Полностью пересчитывает поисковые документы товаров (`Product.search_vector`) по названию, категории,
+    тэгам, описанию и характеристикам. В обычном режиме документы обновляются при изменении товаров,
+    категорий и тэгов.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Количество товаров, обрабатываемых за один запрос.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Handles the flow of the command.
+        """
+        chunk_size = options["chunk_size"]
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(product_ids), chunk_size):
+            update_search_vectors(product_ids[start:start + chunk_size])
+
+        print("Пересчитано поисковых документов:", len(product_ids))
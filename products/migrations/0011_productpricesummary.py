@@ -0,0 +1,147 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_price_summaries(apps, schema_editor):
+    """
+    Create initial price summaries. Discounts are not applied here,
+    run `rebuild_price_summaries` management command to calculate them.
+    """
+    ProductPosition = apps.get_model("products", "ProductPosition")
+    ProductPriceSummary = apps.get_model("products", "ProductPriceSummary")
+    Product = apps.get_model("products", "Product")
+
+    positions_by_product = {
+        product_id: [] for product_id in Product.objects.values_list("pk", flat=True)
+    }
+    for position in ProductPosition.objects.order_by("price"):
+        positions_by_product[position.product_id].append(position)
+
+    summaries = []
+    for product_id, positions in positions_by_product.items():
+        summary = ProductPriceSummary(product_id=product_id)
+        if positions:
+            prices = [position.price for position in positions]
+            summary.min_price = prices[0]
+            summary.max_price = prices[-1]
+            summary.avg_price = summary.avg_price_with_discount = round(
+                sum(prices) / len(prices), 2
+            )
+            summary.total_quantity = sum(position.quantity for position in positions)
+            summary.cheapest_position_id = positions[0].pk
+            summary.free_shipping = any(
+                position.free_shipping for position in positions
+            )
+        summaries.append(summary)
+    ProductPriceSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0010_productposition_free_shipping"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductPriceSummary",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="price_summary",
+                        serialize=False,
+                        to="products.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "min_price",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Минимальная цена",
+                    ),
+                ),
+                (
+                    "max_price",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Максимальная цена",
+                    ),
+                ),
+                (
+                    "avg_price",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Средняя цена",
+                    ),
+                ),
+                (
+                    "avg_price_with_discount",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Средняя цена со скидкой",
+                    ),
+                ),
+                (
+                    "total_quantity",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Общее количество на складах"
+                    ),
+                ),
+                (
+                    "free_shipping",
+                    models.BooleanField(
+                        default=False, verbose_name="Есть бесплатная доставка"
+                    ),
+                ),
+                (
+                    "updated",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+                (
+                    "cheapest_position",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="products.productposition",
+                        verbose_name="Самая дешёвая позиция",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сводка цен товара",
+                "verbose_name_plural": "Сводки цен товаров",
+                "indexes": [
+                    models.Index(
+                        fields=["avg_price"], name="products_pr_avg_pri_91c135_idx"
+                    ),
+                    models.Index(
+                        fields=["total_quantity"], name="products_pr_total_q_d89d22_idx"
+                    ),
+                    models.Index(
+                        fields=["free_shipping"], name="products_pr_free_sh_215ab5_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_price_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0011_productpricesummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="popularity",
+            field=models.FloatField(default=0, verbose_name="популярность"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["-popularity"], name="products_pr_popular_04c80f_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Same document as built by `products.search.get_search_document()`
+FILL_SEARCH_VECTORS_SQL = """
+UPDATE products_product AS product SET search_vector =
+    setweight(to_tsvector('russian', coalesce(product.title, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce(
+        (SELECT category.title FROM products_category AS category WHERE category.id = product.category_id), ''
+    )), 'B')
+    || setweight(to_tsvector('russian', coalesce(
+        (SELECT string_agg(tag.title, ' ') FROM products_tag AS tag
+         JOIN products_product_tags AS product_tag ON product_tag.tag_id = tag.id
+         WHERE product_tag.product_id = product.id), ''
+    )), 'B')
+    || setweight(to_tsvector('russian', coalesce(product.description, '')), 'C')
+    || setweight(to_tsvector('russian', coalesce(
+        (SELECT string_agg(value, ' ') FROM jsonb_each_text(
+            CASE WHEN jsonb_typeof(product.features) = 'object' THEN product.features END
+        )), ''
+    )), 'D');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0012_product_popularity"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="поисковый документ"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="product_search_vector_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"],
+                name="product_title_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.RunSQL(FILL_SEARCH_VECTORS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:16
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0013_product_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["features"], name="product_features_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:18
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_reviews_count(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    Review = apps.get_model("products", "Review")
+    reviews_count = (
+        Review.objects.filter(product=OuterRef("pk"))
+        .order_by()
+        .values("product")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Product.objects.update(reviews_count=Coalesce(Subquery(reviews_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0014_product_features_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="reviews_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="количество отзывов"
+            ),
+        ),
+        migrations.RunPython(fill_reviews_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["reviews_count", "id"], name="products_pr_reviews_99325b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["updated", "id"], name="products_pr_updated_e45079_idx"
+            ),
+        ),
+    ]
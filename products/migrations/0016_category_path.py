@@ -0,0 +1,60 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    """Calculate materialized paths of existing categories from the root down."""
+    Category = apps.get_model("products", "Category")
+    parents = dict(Category.objects.values_list("pk", "parent_id"))
+    paths = {}
+
+    def get_path(category_id):
+        if category_id not in paths:
+            parent_id = parents[category_id]
+            paths[category_id] = (
+                get_path(parent_id) if parent_id else ""
+            ) + f"{category_id}/"
+        return paths[category_id]
+
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.path = get_path(category.pk)
+        category.depth = category.path.count("/") - 1
+    Category.objects.bulk_update(categories, ["path", "depth"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0015_product_reviews_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(
+                default=0, editable=False, verbose_name="уровень вложенности"
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                default="",
+                editable=False,
+                max_length=255,
+                verbose_name="путь в дереве категорий",
+            ),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(
+                fields=["path"],
+                name="category_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 4.2.3 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_available_quantity(apps, schema_editor):
+    ProductPriceSummary = apps.get_model("products", "ProductPriceSummary")
+    # There are no reservations yet
+    ProductPriceSummary.objects.update(available_quantity=F("total_quantity"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0017_cartitem"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockReservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "session_key",
+                    models.CharField(
+                        max_length=40, verbose_name="ключ сессии покупателя"
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField(verbose_name="количество")),
+                ("expires", models.DateTimeField(verbose_name="действует до")),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, verbose_name="создан"),
+                ),
+            ],
+            options={
+                "verbose_name": "резерв товара",
+                "verbose_name_plural": "резервы товаров",
+            },
+        ),
+        migrations.AddField(
+            model_name="productpricesummary",
+            name="available_quantity",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Доступное количество без резервов"
+            ),
+        ),
+        migrations.RunPython(fill_available_quantity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="productpricesummary",
+            index=models.Index(
+                fields=["available_quantity"], name="products_pr_availab_ad5495_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockreservation",
+            name="product_position",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reservations",
+                to="products.productposition",
+                verbose_name="товарная позиция",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockreservation",
+            index=models.Index(
+                fields=["product_position", "expires"],
+                include=("quantity",),
+                name="reservation_position_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockreservation",
+            index=models.Index(fields=["session_key"], name="reservation_session_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="stockreservation",
+            index=models.Index(fields=["expires"], name="reservation_expires_idx"),
+        ),
+    ]
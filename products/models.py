@@ -1,10 +1,17 @@
-import random
-from datetime import datetime
-
-from django.db import models
-from django.db.models import Avg, Max, Min, Q
+from collections import defaultdict
+from datetime import date
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Concat, Substr
 from django.templatetags.static import static
+from django.utils import timezone
 
+from products.image_urls import image_url_cache
+from products.selections import RandomPool
 from users.models import CustomUser
 
 
@@ -39,11 +46,26 @@ class Category(models.Model):
         verbose_name="удалена",
         default=False,
     )
+    # Materialized path: ids of the root, ..., the parent and the category itself, e.g. "3/12/"
+    path = models.CharField(
+        verbose_name="путь в дереве категорий",
+        max_length=255,
+        default="",
+        editable=False,
+    )
+    depth = models.PositiveSmallIntegerField(
+        verbose_name="уровень вложенности",
+        default=0,
+        editable=False,
+    )
+
+    PATH_SEPARATOR = "/"
 
     class Meta:
         ordering = ["title"]
         indexes = [
             models.Index(fields=["title"]),
+            models.Index(fields=["path"], name="category_path_idx", opclasses=["varchar_pattern_ops"]),
         ]
         verbose_name = "категория"
         verbose_name_plural = "категории"
@@ -53,7 +75,102 @@ class Category(models.Model):
         return cls.objects.filter(is_chosen=True)[:3]
 
     def __str__(self):
-        return self.title if not self.parent else f"{self.parent.title} / {self.title}"
+        from products.categories import category_tree
+
+        # Take titles of parent categories from the cached tree instead of querying them one by one
+        node = category_tree.get(self.pk)
+        if node is not None and node.title == self.title:
+            return node.path_title
+        return self.title if not self.parent_id else f"{self.parent.title} / {self.title}"
+
+    def clean(self):
+        if self.pk:
+            self.get_path()
+
+    def get_path(self) -> str:
+        """Return materialized path of the category according to its current parent."""
+        parent_path = ""
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+        separator = self.PATH_SEPARATOR
+        if self.pk and f"{separator}{self.pk}{separator}" in f"{separator}{parent_path}":
+            raise ValidationError({"parent": "Категория не может быть вложена в саму себя или в свою подкатегорию."})
+        return f"{parent_path}{self.pk}{separator}"
+
+    def save(self, *args, **kwargs):
+        """Save the category and update materialized paths of its subtree if it's created or moved."""
+        with transaction.atomic():
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = self.get_path()
+                self.depth = self.path.count(self.PATH_SEPARATOR) - 1
+                Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            old_path = self.path or Category.objects.filter(pk=self.pk).values_list("path", flat=True).first()
+            self.path = self.get_path()
+            new_depth = self.path.count(self.PATH_SEPARATOR) - 1
+            self.moved = bool(old_path) and old_path != self.path
+            if self.moved:
+                # Move the whole subtree before saving, so that receivers of `post_save` see actual paths
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr("path", len(old_path) + 1)),
+                    depth=F("depth") + (new_depth - self.depth),
+                )
+            self.depth = new_depth
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def rebuild_paths(cls) -> int:
+        """
+        Recalculate materialized paths and depths of all categories from their parents
+        (e.g. after `loaddata`, which saves categories raw). Return number of updated categories.
+        """
+        from products.caching import VERSION_CATEGORIES, bump_versions
+        from products.discounts import offer_index
+
+        children = defaultdict(list)
+        for category in cls.objects.only("parent", "path", "depth"):
+            children[category.parent_id].append(category)
+
+        changed = []
+        stack = [(category, "") for category in children[None]]
+        while stack:
+            category, parent_path = stack.pop()
+            path = f"{parent_path}{category.pk}{cls.PATH_SEPARATOR}"
+            depth = path.count(cls.PATH_SEPARATOR) - 1
+            if category.path != path or category.depth != depth:
+                category.path, category.depth = path, depth
+                changed.append(category)
+            stack.extend((child, path) for child in children[category.pk])
+
+        if changed:
+            cls.objects.bulk_update(changed, ["path", "depth"])
+            # Other processes must not cache the tree or rebuild the offer index before paths are committed
+            transaction.on_commit(lambda: bump_versions(VERSION_CATEGORIES))
+            transaction.on_commit(offer_index.invalidate)
+        return len(changed)
+
+    def ancestors(self):
+        """Return queryset of parent categories of all levels, from the root down."""
+        ancestor_ids = [int(category_id) for category_id in self.path.split(self.PATH_SEPARATOR)[:-2]]
+        return Category.objects.filter(pk__in=ancestor_ids).order_by("depth")
+
+    def descendants(self, include_self: bool = False):
+        """Return queryset of subcategories of all levels."""
+        if not self.path:
+            # Path is not filled yet, an empty prefix would match all categories
+            queryset = Category.objects.filter(pk=self.pk)
+        else:
+            queryset = Category.objects.filter(path__startswith=self.path)
+        return queryset if include_self else queryset.exclude(pk=self.pk)
+
+    def products_in_subtree(self):
+        """Return queryset of products of the category and its subcategories of all levels."""
+        if not self.path:
+            # Path is not filled yet, an empty prefix would match all products
+            return Product.objects.filter(category=self)
+        return Product.objects.filter(category__path__startswith=self.path)
 
 
 class Tag(models.Model):
@@ -116,6 +233,20 @@ class Product(models.Model):
         verbose_name="удалён",
         default=False,
     )
+    popularity = models.FloatField(
+        verbose_name="популярность",
+        default=0,
+    )
+    reviews_count = models.PositiveIntegerField(
+        verbose_name="количество отзывов",
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name="поисковый документ",
+        null=True,
+        editable=False,
+    )
     created = models.DateTimeField(
         verbose_name="создан",
         auto_now_add=True,
@@ -131,51 +262,53 @@ class Product(models.Model):
             models.Index(fields=["id"]),
             models.Index(fields=["title"]),
             models.Index(fields=["-created"]),
+            models.Index(fields=["-popularity"]),
+            models.Index(fields=["reviews_count", "id"]),
+            models.Index(fields=["updated", "id"]),
+            GinIndex(fields=["search_vector"], name="product_search_vector_idx"),
+            GinIndex(fields=["title"], name="product_title_trgm_idx", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["features"], name="product_features_idx"),
         ]
         verbose_name = "товар"
         verbose_name_plural = "товары"
 
     @classmethod
     def get_popular_products(cls):
-        return cls.objects.filter(is_deleted=False).order_by("?")[:8]
+        return popular_products_pool.sample(k=8)
 
     @classmethod
     def get_limited_edition_products(cls):
-        return cls.objects.filter(is_limited=True, is_deleted=False, is_chosen=False).order_by("?")[:16]
+        return limited_edition_products_pool.sample(k=16)
+
+    def get_price_summary(self):
+        """Return denormalized price summary of the product, creating it if it doesn't exist yet."""
+        try:
+            return self.price_summary
+        except ProductPriceSummary.DoesNotExist:
+            self.price_summary = ProductPriceSummary.refresh_for_products([self.pk])[0]
+            return self.price_summary
 
     def get_min_price(self):
-        return self.productposition_set.aggregate(lowest_price=Min("price"))["lowest_price"]
+        return self.get_price_summary().min_price
 
     def get_avg_price(self):
         """Return average price of all product positions for this product, rounded to two decimal places."""
-        return round(
-            self.productposition_set.aggregate(average_price=Avg("price"))["average_price"],
-            2,
-        )
+        return self.get_price_summary().avg_price
 
     def get_avg_price_with_discount(self):
         """
         Return average price of all product positions for this product, rounded to two decimal places,
         with maximum discount applied.
         """
-        prices_with_discount = [
-            position.get_price_with_discount() for position in self.productposition_set.all()
-        ]
-        average_price = round(sum(prices_with_discount) / len(prices_with_discount), 2)
-        if average_price < 1:
-            average_price = 1
-        return average_price
+        return self.get_price_summary().avg_price_with_discount
 
     @property
     def get_max_price(self):
-        return self.productposition_set.aggregate(highest_price=Max("price"))["highest_price"]
+        return self.get_price_summary().max_price
 
     @property
     def get_old_price(self):
-        old_price = self.productposition_set.aggregate(Avg("price"))["price__avg"]
-        if not old_price:
-            return None
-        return round(old_price, 2)
+        return self.get_price_summary().avg_price or None
 
     # @property
     # def get_new_price_and_sale(self):
@@ -207,7 +340,20 @@ class Product(models.Model):
 
     @property
     def get_lowest_price_position(self):
-        return self.productposition_set.order_by("price").first()
+        return self.get_price_summary().cheapest_position
+
+    @property
+    def cover_image(self):
+        """
+        Return image file of the first product image or None.
+
+        Prefetched images are used if there are any (`prefetch_related("images")`), and the storage is not checked
+        for the file, so rendering a list of product cards needs neither extra queries nor file system calls.
+        """
+        cover_image = self.images.first()
+        if cover_image is None or not cover_image.image:
+            return None
+        return cover_image.image
 
     def __str__(self):
         return self.title
@@ -248,16 +394,9 @@ class ProductImage(models.Model):
         Return image URL if image file exists.
 
         Otherwise, return URL of the static product image placeholder.
+        Existence of the file is memoized, see `ImageURLCache`.
         """
-        try:
-            url = (
-                self.image.url
-                if self.image.storage.exists(self.image.file.name)
-                else ""
-            )
-        except FileNotFoundError:
-            url = static("/assets/img/product-placeholder.png")
-        return url
+        return image_url_cache.get_url(self.image) or static("/assets/img/product-placeholder.png")
 
 
 class Offer(models.Model):
@@ -334,6 +473,34 @@ class Offer(models.Model):
     def __str__(self):
         return self.description[:64]
 
+    @classmethod
+    def get_active_offers(cls):
+        """Return offers which are active and valid for today."""
+        today = date.today()
+        return cls.objects.filter(
+            is_active=True,
+            date_start__lte=today,
+            date_end__gte=today,
+        )
+
+    @classmethod
+    def apply_offer(cls, offer, price):
+        """
+        Return price with given offer (if any) applied, rounded to two decimal positions.
+        Price with discount never goes below 1.
+        """
+        price_with_discount = price
+        if offer:
+            if offer.discount_type == cls.Types.DISCOUNT_PERCENT:
+                price_with_discount -= (price_with_discount * offer.discount_value) / 100
+            elif offer.discount_type == cls.Types.DISCOUNT_AMOUNT:
+                price_with_discount -= offer.discount_value
+            elif offer.discount_type == cls.Types.FIXED_PRICE:
+                price_with_discount = offer.discount_value
+        if price_with_discount < 1:
+            price_with_discount = 1
+        return round(price_with_discount, 2)
+
 
 class AdBanner(models.Model):
     image = models.ImageField(
@@ -364,10 +531,7 @@ class AdBanner(models.Model):
 
     @classmethod
     def get_banners(cls):
-        banners = cls.objects.filter(is_chosen=True)
-        possible_banners = random.sample(list(banners.values_list("id", flat=True)), k=3)
-        random_banners = banners.filter(pk__in=possible_banners)
-        return random_banners
+        return banners_pool.sample(k=3)
 
 
 class Review(models.Model):
@@ -490,25 +654,284 @@ class ProductPosition(models.Model):
         Return price with discount applied, or base price if there's no discounts for this product,
         rounded to two decimal positions.
         """
-        price_with_discount = self.price
+        from products.discounts import offer_index
 
         # Find applicable offer with top priority
-        top_offer = (
-            Offer.objects.filter(
-                is_active=True,
-                date_start__lte=datetime.today(),
-                date_end__gte=datetime.today(),
+        top_offer = offer_index.get_top_offer(self.product_id, self.product.category_id)
+        return Offer.apply_offer(top_offer, self.price)
+
+
+class ProductPriceSummary(models.Model):
+    """
+    Keeps denormalized price and stock figures over all product positions of the product.
+    Refreshed on `ProductPosition` and `Offer` writes (see `products.signals`), and completely rebuilt
+    with `rebuild_price_summaries` management command.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="price_summary",
+        verbose_name="Товар",
+    )
+    min_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name="Минимальная цена",
+    )
+    max_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name="Максимальная цена",
+    )
+    avg_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name="Средняя цена",
+    )
+    avg_price_with_discount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name="Средняя цена со скидкой",
+    )
+    total_quantity = models.PositiveIntegerField(
+        verbose_name="Общее количество на складах",
+        default=0,
+    )
+    available_quantity = models.PositiveIntegerField(
+        verbose_name="Доступное количество без резервов",
+        default=0,
+    )
+    cheapest_position = models.ForeignKey(
+        ProductPosition,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="Самая дешёвая позиция",
+    )
+    free_shipping = models.BooleanField(
+        verbose_name="Есть бесплатная доставка",
+        default=False,
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата обновления",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["avg_price"]),
+            models.Index(fields=["total_quantity"]),
+            models.Index(fields=["available_quantity"]),
+            models.Index(fields=["free_shipping"]),
+        ]
+        verbose_name = "Сводка цен товара"
+        verbose_name_plural = "Сводки цен товаров"
+
+    def __str__(self):
+        return str(self.product_id)
+
+    @classmethod
+    def refresh_for_products(cls, product_ids) -> list:
+        """
+        Recalculate price summaries for products with given ids using a single query for positions,
+        and save those which changed. Return list of summaries.
+        """
+        from products.caching import VERSION_POSITIONS, bump_versions
+        from products.discounts import offer_index
+
+        # Skip products deleted in the meantime
+        product_ids = set(Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+        saved_summaries = cls.objects.in_bulk(product_ids)
+        reserved_quantities = StockReservation.get_reserved_quantities(
+            ProductPosition.objects.filter(product_id__in=product_ids).values("pk")
+        )
+        summaries = {product_id: cls(product_id=product_id) for product_id in product_ids}
+        positions_by_product = {product_id: [] for product_id in product_ids}
+        # Ordered, so that the cheapest position is the same among equally priced ones on every refresh
+        positions = (
+            ProductPosition.objects.filter(product_id__in=product_ids)
+            .order_by("pk")
+            .values_list("id", "product_id", "product__category_id", "price", "quantity", "free_shipping")
+        )
+        for position in positions:
+            positions_by_product[position[1]].append(position)
+
+        for product_id, product_positions in positions_by_product.items():
+            if not product_positions:
+                continue
+            summary = summaries[product_id]
+            prices = [position[3] for position in product_positions]
+            top_offer = offer_index.get_top_offer(product_id, product_positions[0][2])
+            prices_with_discount = [Offer.apply_offer(top_offer, price) for price in prices]
+
+            summary.min_price = min(prices)
+            summary.max_price = max(prices)
+            summary.avg_price = round(sum(prices) / len(prices), 2)
+            summary.avg_price_with_discount = max(round(sum(prices_with_discount) / len(prices_with_discount), 2), 1)
+            summary.total_quantity = sum(position[4] for position in product_positions)
+            summary.available_quantity = sum(
+                max(position[4] - reserved_quantities.get(position[0], 0), 0) for position in product_positions
             )
-            .filter(Q(products__in=[self.product]) | Q(categories__in=[self.product.category]))
-            .order_by("-priority")
-        ).first()
-        if top_offer:
-            if top_offer.discount_type == Offer.Types.DISCOUNT_PERCENT:
-                price_with_discount -= (price_with_discount * top_offer.discount_value) / 100
-            elif top_offer.discount_type == Offer.Types.DISCOUNT_AMOUNT:
-                price_with_discount -= top_offer.discount_value
-            elif top_offer.discount_type == Offer.Types.FIXED_PRICE:
-                price_with_discount = top_offer.discount_value
-        if price_with_discount < 1:
-            price_with_discount = 1
-        return round(price_with_discount, 2)
+            summary.cheapest_position_id = min(product_positions, key=lambda position: position[3])[0]
+            summary.free_shipping = any(position[5] for position in product_positions)
+
+        fields = [
+            "min_price",
+            "max_price",
+            "avg_price",
+            "avg_price_with_discount",
+            "total_quantity",
+            "available_quantity",
+            "cheapest_position_id",
+            "free_shipping",
+        ]
+        # Most refreshes (reservations, periodic sweeps) change nothing, so only differing summaries
+        # are saved, and cached content is invalidated only if there are any
+        changed_ids = {
+            product_id
+            for product_id, summary in summaries.items()
+            if product_id not in saved_summaries
+            or any(getattr(summary, field) != getattr(saved_summaries[product_id], field) for field in fields)
+        }
+        if changed_ids:
+            bump_versions(VERSION_POSITIONS)
+            cls.objects.bulk_create(
+                [summaries[product_id] for product_id in changed_ids],
+                update_conflicts=True,
+                unique_fields=["product"],
+                update_fields=[*fields, "updated"],
+            )
+        return [
+            summary if product_id in changed_ids else saved_summaries[product_id]
+            for product_id, summary in summaries.items()
+        ]
+
+
+class CartItem(models.Model):
+    """Line of a user's shopping cart kept in the database (see `products.cart_storage.DatabaseCartStorage`)."""
+
+    user = models.ForeignKey(
+        verbose_name="пользователь",
+        to=CustomUser,
+        related_name="cart_items",
+        on_delete=models.CASCADE,
+    )
+    product_position = models.ForeignKey(
+        verbose_name="товарная позиция",
+        to=ProductPosition,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name="количество",
+        default=0,
+    )
+    price = models.DecimalField(
+        verbose_name="цена со скидкой",
+        max_digits=10,
+        decimal_places=2,
+    )
+    created = models.DateTimeField(
+        verbose_name="создан",
+        auto_now_add=True,
+    )
+    updated = models.DateTimeField(
+        verbose_name="обновлён",
+        auto_now=True,
+    )
+
+    class Meta:
+        ordering = ["created"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product_position"], name="unique_cart_item"),
+        ]
+        verbose_name = "товар в корзине"
+        verbose_name_plural = "товары в корзинах"
+
+    def __str__(self):
+        return f"{self.user} - {self.product_position_id} x {self.quantity}"
+
+
+class StockReservation(models.Model):
+    """
+    Time-limited hold on the product position quantity, placed for the buyer's cart when checkout reaches
+    the payment step (see `products.reservations`).
+    """
+
+    product_position = models.ForeignKey(
+        verbose_name="товарная позиция",
+        to=ProductPosition,
+        related_name="reservations",
+        on_delete=models.CASCADE,
+    )
+    session_key = models.CharField(
+        verbose_name="ключ сессии покупателя",
+        max_length=40,
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name="количество",
+    )
+    expires = models.DateTimeField(
+        verbose_name="действует до",
+    )
+    created = models.DateTimeField(
+        verbose_name="создан",
+        auto_now_add=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Active holds of positions are summed on every stock check
+            models.Index(fields=["product_position", "expires"], include=["quantity"], name="reservation_position_idx"),
+            models.Index(fields=["session_key"], name="reservation_session_idx"),
+            models.Index(fields=["expires"], name="reservation_expires_idx"),
+        ]
+        verbose_name = "резерв товара"
+        verbose_name_plural = "резервы товаров"
+
+    def __str__(self):
+        return f"{self.product_position_id} x {self.quantity} до {self.expires}"
+
+    @classmethod
+    def get_reserved_quantities(cls, product_position_ids, exclude_session_key: str = None) -> dict:
+        """
+        Return quantities held by active reservations, by product position ids.
+
+        :param product_position_ids: ids of product positions (or a subquery selecting them).
+        :param exclude_session_key: leave out holds of the buyer with this session key.
+        """
+        reservations = cls.objects.filter(product_position_id__in=product_position_ids, expires__gt=timezone.now())
+        if exclude_session_key:
+            reservations = reservations.exclude(session_key=exclude_session_key)
+        return dict(reservations.order_by().values_list("product_position_id").annotate(total_quantity=Sum("quantity")))
+
+
+# Pools for random selection of products and banners on the index page
+popular_products_pool = RandomPool(
+    name="popular_products",
+    get_queryset=lambda: Product.objects.filter(is_deleted=False).select_related("category"),
+    ordering=["-popularity"],
+    pool_size=24,
+)
+limited_edition_products_pool = RandomPool(
+    name="limited_edition_products",
+    get_queryset=lambda: Product.objects.filter(
+        is_limited=True, is_deleted=False, is_chosen=False
+    ).select_related("category"),
+)
+banners_pool = RandomPool(
+    name="banners",
+    get_queryset=lambda: AdBanner.objects.filter(is_chosen=True),
+    pool_size=100,
+)
@@ -0,0 +1,178 @@
+"""
+Contains paginators of the catalog: keyset (cursor) paginator, which doesn't count rows or use OFFSET,
+and page number paginator with the total count cached.
+"""
+from datetime import datetime
+from decimal import Decimal
+from functools import reduce
+from typing import Optional
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    """Cursor token is malformed, tampered with or doesn't match the sorting."""
+
+
+class KeysetPage:
+    """
+    Page of objects fetched by `KeysetPaginator`.
+
+    Attributes:
+        object_list: objects of the page.
+        next_cursor: opaque token of the next page or None if this page is the last one.
+        previous_cursor: opaque token of the previous page or None if this page is the first one.
+    """
+
+    def __init__(self, object_list: list, next_cursor: Optional[str], previous_cursor: Optional[str]):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate queryset by values of its sort fields instead of OFFSET: every page is fetched with
+    a single query `WHERE (sort fields) > (values of the last row) ORDER BY sort fields LIMIT per_page + 1`,
+    so deep pages are as fast as the first one and no `COUNT(*)` query is needed.
+
+    Primary key is always appended to the ordering as a tiebreaker, so that the ordering is total.
+    Sort fields must be fields or annotations of the model itself and must not be nullable
+    (wrap related or nullable ones into `Coalesce` annotations).
+
+    Usage:
+        paginator = KeysetPaginator(queryset, ordering=["-popularity"], per_page=6)
+        page = paginator.get_page(request.GET.get("cursor"))
+    """
+
+    SALT = "products.pagination.cursor"
+    NEXT = "n"
+    PREVIOUS = "p"
+
+    def __init__(self, queryset: QuerySet, ordering: list, per_page: int):
+        self.queryset = queryset
+        self.ordering = [field for field in ordering if field.lstrip("-") not in ("pk", "id")]
+        descending = self.ordering[0].startswith("-") if self.ordering else False
+        self.ordering.append("-pk" if descending else "pk")
+        self.per_page = per_page
+
+    @cached_property
+    def fields(self) -> list:
+        """Return (field name, is descending) pairs of the ordering."""
+        return [(field.lstrip("-"), field.startswith("-")) for field in self.ordering]
+
+    def get_page(self, cursor: Optional[str]) -> KeysetPage:
+        """Return the page for given cursor token, or the first page if there is no valid cursor."""
+        try:
+            direction, values = self.decode_cursor(cursor) if cursor else (self.NEXT, None)
+        except InvalidCursor:
+            direction, values = self.NEXT, None
+
+        backwards = direction == self.PREVIOUS
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._get_seek_condition(values, backwards))
+        ordering = [self._reverse(field) for field in self.ordering] if backwards else self.ordering
+        objects = list(queryset.order_by(*ordering)[: self.per_page + 1])
+
+        has_more = len(objects) > self.per_page
+        objects = objects[: self.per_page]
+        if backwards:
+            objects.reverse()
+
+        if not objects:
+            return KeysetPage(objects, None, None)
+
+        has_next = has_more if not backwards else True
+        has_previous = (values is not None) if not backwards else has_more
+        return KeysetPage(
+            objects,
+            self.encode_cursor(self.NEXT, objects[-1]) if has_next else None,
+            self.encode_cursor(self.PREVIOUS, objects[0]) if has_previous else None,
+        )
+
+    @staticmethod
+    def _reverse(field: str) -> str:
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    def _get_seek_condition(self, values: list, backwards: bool) -> Q:
+        """
+        Return condition selecting rows after (or before) the row with given sort values:
+        `a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)` with comparisons flipped for descending fields.
+        """
+        conditions = []
+        for index, (field, descending) in enumerate(self.fields):
+            lookup = "lt" if descending != backwards else "gt"
+            equal = {name: value for (name, _), value in zip(self.fields[:index], values[:index])}
+            conditions.append(Q(**equal, **{f"{field}__{lookup}": values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def _get_values(self, obj) -> list:
+        values = []
+        for field, _ in self.fields:
+            value = getattr(obj, field)
+            if isinstance(value, datetime):
+                value = {"dt": value.isoformat()}
+            elif isinstance(value, Decimal):
+                value = {"d": str(value)}
+            values.append(value)
+        return values
+
+    def encode_cursor(self, direction: str, obj) -> str:
+        """Return signed token pointing at the object in given direction."""
+        return signing.dumps([direction, self.ordering, self._get_values(obj)], salt=self.SALT, compress=True)
+
+    def decode_cursor(self, cursor: str) -> tuple:
+        """Return direction and sort values from the token, raise `InvalidCursor` if it's not valid."""
+        try:
+            direction, ordering, values = signing.loads(cursor, salt=self.SALT)
+        except (signing.BadSignature, TypeError, ValueError) as error:
+            raise InvalidCursor from error
+        if ordering != self.ordering or len(values) != len(self.fields) or direction not in (self.NEXT, self.PREVIOUS):
+            raise InvalidCursor
+
+        decoded = []
+        for value in values:
+            if isinstance(value, dict) and "dt" in value:
+                value = parse_datetime(value["dt"])
+            elif isinstance(value, dict) and "d" in value:
+                value = Decimal(value["d"])
+            decoded.append(value)
+        return direction, decoded
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator which caches the total count under given key, so that `COUNT(*)` over filtered products
+    is run once per filter set and version of products instead of on every page.
+    """
+
+    def __init__(self, *args, count_cache_key: str, count_cache_timeout: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_cache_key = count_cache_key
+        self.count_cache_timeout = count_cache_timeout
+
+    @cached_property
+    def count(self) -> int:
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_cache_key, count, self.count_cache_timeout)
+        return count
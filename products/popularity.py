@@ -0,0 +1,69 @@
+"""
+Contains functions to maintain products popularity score, calculated from ordered quantities with time decay.
+
+Forward decay is used: each ordered item adds `quantity * 2 ** (age_of_epoch / half_life)` to the score,
+so newer orders weigh more, and existing scores never have to be rescaled to keep ranking correct.
+"""
+from datetime import datetime, timezone
+
+from django.db.models import Case, F, Sum, Value, When
+
+from orders.models import Order, OrderItem
+from products.caching import VERSION_POPULARITY, bump_versions
+from products.models import Product
+
+POPULARITY_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+POPULARITY_HALF_LIFE_DAYS = 30
+
+# Placed order counts as a half, its payment adds another half
+ORDER_CREATED_WEIGHT = 0.5
+ORDER_PAID_WEIGHT = 0.5
+
+
+def get_decay_weight(moment: datetime) -> float:
+    """Return weight of an order made at given moment."""
+    age_of_epoch = (moment - POPULARITY_EPOCH).total_seconds() / 86400
+    return 2 ** (age_of_epoch / POPULARITY_HALF_LIFE_DAYS)
+
+
+def add_order_popularity(order_id: int, weight: float) -> None:
+    """Add quantities of the order items to popularity scores of ordered products with a single update."""
+    order = Order.objects.filter(pk=order_id).only("created").first()
+    if not order:
+        return
+
+    quantities = (
+        OrderItem.objects.filter(order_id=order_id)
+        .values_list("product_position__product_id")
+        .annotate(total_quantity=Sum("quantity"))
+    )
+    decay_weight = get_decay_weight(order.created) * weight
+    increments = {product_id: quantity * decay_weight for product_id, quantity in quantities}
+    if not increments:
+        return
+
+    Product.objects.filter(pk__in=increments.keys()).update(
+        popularity=F("popularity") + Case(
+            *[When(pk=product_id, then=Value(increment)) for product_id, increment in increments.items()]
+        )
+    )
+    bump_versions(VERSION_POPULARITY)
+
+
+def rebuild_popularity(chunk_size: int = 2000) -> int:
+    """Recalculate popularity scores of all products from scratch. Return number of updated products."""
+    scores = dict.fromkeys(Product.objects.values_list("pk", flat=True), 0.0)
+    order_items = OrderItem.objects.values_list(
+        "product_position__product_id",
+        "quantity",
+        "order__created",
+        "order__is_paid",
+    )
+    for product_id, quantity, created, is_paid in order_items.iterator(chunk_size=chunk_size):
+        weight = ORDER_CREATED_WEIGHT + (ORDER_PAID_WEIGHT if is_paid else 0)
+        scores[product_id] += quantity * get_decay_weight(created) * weight
+
+    products = [Product(pk=product_id, popularity=score) for product_id, score in scores.items()]
+    Product.objects.bulk_update(products, ["popularity"], batch_size=chunk_size)
+    bump_versions(VERSION_POPULARITY)
+    return len(products)
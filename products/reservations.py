@@ -0,0 +1,103 @@
+"""
+Contains functions to hold product position quantities for buyers during checkout.
+
+When checkout reaches the payment step, quantities of the cart lines are reserved for the buyer's session
+for `RESERVATION_TIMEOUT`. Stock available to other buyers is the position quantity minus active holds.
+Holds are released when the order is placed (its quantities are taken off the stock then, see `Order.place`)
+or the cart is cleared, and expired ones are deleted by a periodic task.
+"""
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from products.models import (ProductPosition, ProductPriceSummary,
+                             StockReservation)
+
+RESERVATION_TIMEOUT = timedelta(minutes=15)
+
+
+def schedule_stock_refresh(product_ids) -> None:
+    """Recalculate available quantities of products after the current transaction is committed."""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: ProductPriceSummary.refresh_for_products(product_ids))
+
+
+def get_available_quantity(product_position: ProductPosition, session_key: Optional[str]) -> int:
+    """Return quantity of the product position which isn't held by other buyers than the one with given session key."""
+    reserved_by_others = StockReservation.get_reserved_quantities(
+        [product_position.pk], exclude_session_key=session_key
+    )
+    return max(product_position.quantity - reserved_by_others.get(product_position.pk, 0), 0)
+
+
+def reserve_cart(session_key: str, lines: dict) -> dict:
+    """
+    Replace holds of the buyer with holds for the cart lines, as much as there's available stock.
+    Return reserved quantities by product position ids (str, as cart lines are keyed).
+
+    Product positions are locked for the time of the reservation, so concurrent buyers can't hold the same units.
+
+    :param session_key: session key of the buyer.
+    :param lines: cart lines, `{"<product position id>": {"quantity": <int>, "price": "<price with discount>"}}`.
+    """
+    with transaction.atomic():
+        product_positions = {
+            product_position.pk: product_position
+            for product_position in ProductPosition.objects.select_for_update()
+            .filter(pk__in=[int(product_position_id) for product_position_id in lines])
+            .order_by("pk")
+        }
+        released_product_ids = set(
+            StockReservation.objects.filter(session_key=session_key).values_list(
+                "product_position__product_id", flat=True
+            )
+        )
+        StockReservation.objects.filter(session_key=session_key).delete()
+        reserved_by_others = StockReservation.get_reserved_quantities(product_positions.keys())
+
+        expires = timezone.now() + RESERVATION_TIMEOUT
+        reserved_quantities = {}
+        reservations = []
+        for product_position_id, line in lines.items():
+            product_position = product_positions.get(int(product_position_id))
+            if product_position is None:
+                reserved_quantities[product_position_id] = 0
+                continue
+            available = max(product_position.quantity - reserved_by_others.get(product_position.pk, 0), 0)
+            quantity = reserved_quantities[product_position_id] = min(int(line["quantity"]), available)
+            if quantity:
+                reservations.append(
+                    StockReservation(
+                        product_position=product_position,
+                        session_key=session_key,
+                        quantity=quantity,
+                        expires=expires,
+                    )
+                )
+        StockReservation.objects.bulk_create(reservations)
+
+        schedule_stock_refresh(
+            released_product_ids | {product_position.product_id for product_position in product_positions.values()}
+        )
+    return reserved_quantities
+
+
+def release_reservations(session_key: str) -> None:
+    """Release all holds of the buyer with given session key."""
+    reservations = StockReservation.objects.filter(session_key=session_key)
+    product_ids = set(reservations.values_list("product_position__product_id", flat=True))
+    if product_ids:
+        reservations.delete()
+        schedule_stock_refresh(product_ids)
+
+
+def release_expired_reservations() -> int:
+    """Delete expired holds and return their number."""
+    reservations = StockReservation.objects.filter(expires__lte=timezone.now())
+    product_ids = set(reservations.values_list("product_position__product_id", flat=True))
+    deleted, _ = reservations.delete()
+    schedule_stock_refresh(product_ids)
+    return deleted
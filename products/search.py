@@ -0,0 +1,79 @@
+"""
+Contains full-text product search backed by PostgreSQL.
+
+Every product keeps a weighted `search_vector` document:
+A - title, B - category and tag titles, C - description, D - feature values.
+The document is updated on writes (see `products.signals`) and rebuilt with `rebuild_search_index` command.
+Search matches the document (GIN index, relevance ranking, Russian stemming), and falls back to
+trigram similarity of titles (GIN trigram index) to tolerate typos.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db.models import (F, FloatField, Func, OuterRef, Q, QuerySet,
+                              Subquery, TextField, Value)
+from django.db.models.functions import Cast, Coalesce
+
+from products.models import Category, Product, Tag
+
+SEARCH_CONFIG = "russian"
+
+
+class JSONObjectValues(Func):
+    """Concatenate all values of JSON object into a space separated string (NULL for other JSON types)."""
+
+    template = (
+        "(SELECT string_agg(value, ' ') FROM jsonb_each_text("
+        "CASE WHEN jsonb_typeof(%(expressions)s) = 'object' THEN %(expressions)s END))"
+    )
+    output_field = TextField()
+
+
+def get_search_document() -> SearchVector:
+    """Return expression building weighted search document of a product."""
+    category_title = Subquery(Category.objects.filter(pk=OuterRef("category_id")).values("title")[:1])
+    tag_titles = Subquery(
+        Tag.objects.filter(products=OuterRef("pk"))
+        .values("products")
+        .annotate(titles=StringAgg("title", delimiter=" "))
+        .values("titles")[:1]
+    )
+
+    def weighted(expression, weight):
+        return SearchVector(
+            Coalesce(expression, Value(""), output_field=TextField()),
+            weight=weight,
+            config=SEARCH_CONFIG,
+        )
+
+    return (
+        weighted(F("title"), "A")
+        + weighted(category_title, "B")
+        + weighted(tag_titles, "B")
+        + weighted(F("description"), "C")
+        + weighted(JSONObjectValues(F("features")), "D")
+    )
+
+
+def update_search_vectors(product_ids) -> None:
+    """Update search documents of products with given ids with a single query."""
+    Product.objects.filter(pk__in=product_ids).update(search_vector=get_search_document())
+
+
+def search_products(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Filter products matching search text either by full-text search or by title similarity,
+    and order them by relevance.
+
+    Relevance scores are computed as `real`, they are cast to `double precision`, so that values
+    read back exactly and can be compared with in cursor pagination.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+    return (
+        queryset.annotate(
+            rank=Cast(SearchRank(F("search_vector"), query), FloatField()),
+            similarity=Cast(TrigramSimilarity("title", text), FloatField()),
+        )
+        .filter(Q(search_vector=query) | Q(title__trigram_similar=text))
+        .order_by("-rank", "-similarity")
+    )
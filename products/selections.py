@@ -0,0 +1,80 @@
+"""
+Contains RandomPool to pick random objects without sorting the whole table on every request.
+"""
+import random
+from typing import Callable, Optional
+
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+
+class RandomPool:
+    """
+    Pool of object ids precomputed for random selection and kept in Django cache.
+
+    Pool is refreshed after `timeout` seconds or on first access after `invalidate()` (called on writes,
+    see `products.signals`). Each request then draws its sample from the pool in O(k) and fetches
+    only sampled objects by primary key.
+    """
+
+    CACHE_KEY_PREFIX = "random_pool"
+
+    def __init__(
+        self,
+        name: str,
+        get_queryset: Callable[[], QuerySet],
+        ordering: Optional[list] = None,
+        pool_size: int = 500,
+        timeout: int = 600,
+    ):
+        """
+        :param name: unique name of the pool, used in cache key.
+        :param get_queryset: callable returning queryset of objects to choose from.
+        :param ordering: if given, the pool is filled with top `pool_size` objects in this order,
+                         otherwise with random ones.
+        :param pool_size: maximum number of ids kept in the pool.
+        :param timeout: number of seconds after which the pool is refreshed.
+        """
+        self.name = name
+        self.get_queryset = get_queryset
+        self.ordering = ordering
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_{self.name}"
+
+    def get_pool_ids(self) -> list:
+        """Return ids from the pool, refreshing it if needed."""
+        pool_ids = cache.get(self.cache_key)
+        if pool_ids is None:
+            pool_ids = self.refresh()
+        return pool_ids
+
+    def get_pool_queryset(self) -> QuerySet:
+        """
+        Return queryset to fill the pool from. Random sort (if no ordering given) happens here once per refresh,
+        and the pool size is limited, so it's cheap enough even for large tables.
+        """
+        if self.ordering:
+            return self.get_queryset().order_by(*self.ordering)
+        return self.get_queryset().order_by("?")
+
+    def refresh(self) -> list:
+        """Recompute pool ids and put them into cache."""
+        pool_ids = list(self.get_pool_queryset().values_list("pk", flat=True)[:self.pool_size])
+        cache.set(self.cache_key, pool_ids, self.timeout)
+        return pool_ids
+
+    def invalidate(self) -> None:
+        """Drop the pool, so it will be recomputed on next access."""
+        cache.delete(self.cache_key)
+
+    def sample(self, k: int) -> list:
+        """Return list of up to `k` random objects from the pool, in random order."""
+        pool_ids = self.get_pool_ids()
+        sample_ids = random.sample(pool_ids, k=min(k, len(pool_ids)))
+        objects = self.get_queryset().in_bulk(sample_ids)
+        # Objects could be deleted or changed since the pool was computed
+        return [objects[pk] for pk in sample_ids if pk in objects]
@@ -0,0 +1,265 @@
+"""
+Contains signal receivers keeping in-process indexes and denormalized data of `products` app up to date.
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.utils import validate_file_name
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from products.caching import (VERSION_CATEGORIES, VERSION_POSITIONS,
+                              VERSION_PRODUCTS, VERSION_SUGGESTIONS,
+                              bump_versions)
+from products.cart_storage import get_cart_storage_class
+from products.discounts import get_offers_product_ids, offer_index
+from products.image_urls import image_url_cache
+from products.models import (AdBanner, Category, Offer, Product, ProductImage,
+                             ProductPosition, ProductPriceSummary, Review,
+                             Seller, Tag, banners_pool,
+                             limited_edition_products_pool,
+                             popular_products_pool)
+from products.search import update_search_vectors
+from products.tasks import generate_image_thumbnails, refresh_price_summaries
+from users.models import CustomUser
+
+
+def schedule_versions_bump(*names: str) -> None:
+    """
+    Bump versions after the current transaction is committed. Bumped earlier, they could let other processes
+    cache data read before the commit under the new versions.
+    """
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+def schedule_price_summaries_refresh(product_ids) -> None:
+    """Refresh price summaries of products in background after the current transaction is committed."""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: refresh_price_summaries.delay(product_ids))
+
+
+@receiver(post_save, sender=Offer)
+def on_offer_saved(sender, instance, **kwargs):
+    """
+    Rebuild active offer index and refresh prices of affected products after any offer is saved.
+    Index is invalidated only after commit: links of the offer are saved after it in the same transaction,
+    and other processes must not rebuild the index before they see them.
+    """
+    transaction.on_commit(offer_index.invalidate)
+    schedule_price_summaries_refresh(get_offers_product_ids([instance.pk]))
+
+
+@receiver(pre_delete, sender=Offer)
+def on_offer_deleting(sender, instance, **kwargs):
+    """Remember products affected by the offer while its links still exist."""
+    instance.affected_product_ids = get_offers_product_ids([instance.pk])
+
+
+@receiver(post_delete, sender=Offer)
+def on_offer_deleted(sender, instance, **kwargs):
+    """Rebuild active offer index and refresh prices of products which were affected by deleted offer."""
+    transaction.on_commit(offer_index.invalidate)
+    schedule_price_summaries_refresh(getattr(instance, "affected_product_ids", ()))
+
+
+@receiver(m2m_changed, sender=Offer.products.through)
+@receiver(m2m_changed, sender=Offer.categories.through)
+def on_offer_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Rebuild active offer index and refresh prices of affected products after products or categories
+    of any offer are changed. Products affected before the change are collected on "pre_*" actions.
+    """
+    if reverse:
+        # `instance` is a product or a category, `pk_set` contains offer ids
+        offer_ids = pk_set or set(instance.offers.values_list("pk", flat=True))
+    else:
+        offer_ids = {instance.pk}
+
+    if action in ("pre_add", "pre_remove", "pre_clear"):
+        instance.affected_product_ids = get_offers_product_ids(offer_ids)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(offer_index.invalidate)
+        affected_product_ids = getattr(instance, "affected_product_ids", set())
+        if action == "post_clear" and reverse:
+            # Links are gone, so only the products collected on "pre_clear" are known
+            offer_ids = set()
+        schedule_price_summaries_refresh(affected_product_ids | get_offers_product_ids(offer_ids))
+
+
+@receiver(post_save, sender=ProductPosition)
+@receiver(post_delete, sender=ProductPosition)
+def on_product_position_changed(sender, instance, **kwargs):
+    """Refresh price summary of the product after any of its positions is changed."""
+    product_id = instance.product_id
+    schedule_versions_bump(VERSION_POSITIONS)
+    transaction.on_commit(lambda: ProductPriceSummary.refresh_for_products([product_id]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(m2m_changed, sender=Product.tags.through)
+def bump_products_version(sender, **kwargs):
+    """Invalidate cached catalog content after products or their related data are changed."""
+    schedule_versions_bump(VERSION_PRODUCTS)
+
+
+@receiver(post_save, sender=Review)
+def on_review_saved(sender, instance, created, **kwargs):
+    """Increment reviews count of the product after a new review is added."""
+    if created:
+        Product.objects.filter(pk=instance.product_id).update(reviews_count=F("reviews_count") + 1)
+
+
+@receiver(post_delete, sender=Review)
+def on_review_deleted(sender, instance, **kwargs):
+    """Decrement reviews count of the product after its review is deleted."""
+    Product.objects.filter(pk=instance.product_id, reviews_count__gt=0).update(
+        reviews_count=F("reviews_count") - 1
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_categories_version(sender, **kwargs):
+    """Rebuild cached category tree after any category is changed."""
+    schedule_versions_bump(VERSION_CATEGORIES)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pools(sender, **kwargs):
+    """Recompute random selection pools of products after any product is changed."""
+    popular_products_pool.invalidate()
+    limited_edition_products_pool.invalidate()
+
+
+@receiver(post_save, sender=AdBanner)
+@receiver(post_delete, sender=AdBanner)
+def invalidate_banners_pool(sender, **kwargs):
+    """Recompute random selection pool of banners after any banner is changed."""
+    banners_pool.invalidate()
+
+
+def schedule_search_vectors_update(product_ids) -> None:
+    """Update search documents of products after the current transaction is committed."""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: update_search_vectors(product_ids))
+
+
+@receiver(post_save, sender=Product)
+def on_product_saved(sender, instance, **kwargs):
+    """Update search document of the saved product."""
+    schedule_search_vectors_update([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def on_product_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update search documents of products after their tags are changed."""
+    if action == "pre_clear" and reverse:
+        # `instance` is a tag, remember its products while links still exist
+        instance.affected_product_ids = set(instance.products.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if not reverse:
+            product_ids = {instance.pk}
+        elif action == "post_clear":
+            product_ids = getattr(instance, "affected_product_ids", set())
+        else:
+            product_ids = pk_set
+        schedule_search_vectors_update(product_ids)
+
+
+@receiver(post_save, sender=Category)
+def on_category_saved(sender, instance, created, **kwargs):
+    """Update search documents of products in the saved category."""
+    if not created:
+        schedule_search_vectors_update(instance.products.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Category)
+def on_category_loaded(sender, instance, raw=False, **kwargs):
+    """Fill materialized paths of categories saved raw, e.g. loaded from fixtures."""
+    if raw:
+        Category.rebuild_paths()
+
+
+@receiver(post_save, sender=Category)
+def on_category_moved(sender, instance, **kwargs):
+    """Rebuild active offer index and refresh prices of products in the subtree after the category is moved."""
+    if getattr(instance, "moved", False):
+        transaction.on_commit(offer_index.invalidate)
+        schedule_price_summaries_refresh(instance.products_in_subtree().values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def on_tag_saved(sender, instance, created, **kwargs):
+    """Update search documents of products with the saved tag."""
+    if not created:
+        schedule_search_vectors_update(instance.products.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_suggestions_version(sender, **kwargs):
+    """Rebuild search suggestions index after products, categories or tags are changed."""
+    schedule_versions_bump(VERSION_SUGGESTIONS)
+
+
+@receiver(pre_save, sender=ProductImage)
+@receiver(pre_save, sender=AdBanner)
+@receiver(pre_save, sender=Seller)
+@receiver(pre_save, sender=CustomUser)
+def on_image_saving(sender, instance, update_fields=None, **kwargs):
+    """Remember the name of the replaced image file."""
+    if instance.pk and (update_fields is None or "image" in update_fields):
+        instance.previous_image_name = sender.objects.filter(pk=instance.pk).values_list("image", flat=True).first()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=AdBanner)
+@receiver(post_save, sender=Seller)
+@receiver(post_save, sender=CustomUser)
+def on_image_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Generate thumbnails of the uploaded image in background."""
+    if update_fields is not None and "image" not in update_fields:
+        # E.g. `last_login` of a user is updated
+        return
+    name = instance.image.name
+    if not name or (not created and name == getattr(instance, "previous_image_name", None)):
+        # No image, or other fields of the object are changed
+        return
+    try:
+        validate_file_name(name, allow_relative_path=True)
+    except SuspiciousFileOperation:
+        return
+    transaction.on_commit(lambda: generate_image_thumbnails.delay(name))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_image_url(sender, instance, **kwargs):
+    """Forget memoized existence of the saved or deleted image file (and of the replaced one)."""
+    for name in {instance.image.name, getattr(instance, "previous_image_name", None)}:
+        if name:
+            image_url_cache.invalidate(name)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """Merge cart collected before login into the user's cart."""
+    get_cart_storage_class().merge_anonymous_cart(request, user)
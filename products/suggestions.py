@@ -0,0 +1,144 @@
+"""
+Contains in-process prefix index of product, category and tag titles for search-as-you-type suggestions.
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from django.db import connection
+
+from products.caching import VERSION_SUGGESTIONS, get_versions
+from products.models import Category, Product, Tag
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Return lowercase words of the text separated with single spaces."""
+    return " ".join(WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+class Suggestion(NamedTuple):
+    kind: str
+    id: int
+    title: str
+    weight: float
+
+
+class IndexSnapshot(NamedTuple):
+    keys: list
+    suggestions: list
+    top_by_short_prefix: dict
+    version: Optional[int]
+
+
+class SuggestionIndex:
+    """
+    In-memory prefix index of product, category and tag titles.
+
+    Every title is indexed by each of its word suffixes (e.g. "xiaomi e32s" and "e32s"),
+    so a prefix matches titles having any word starting with it. Top suggestions for short prefixes
+    (which match most of the titles) are precomputed, longer prefixes are resolved with binary search
+    over sorted keys. Index is rebuilt in a background thread when suggestions version is bumped
+    (see `products.signals`); until the rebuild is finished, requests are served from the previous index.
+
+    Built index is an immutable snapshot replaced with a single assignment, so requests read it without locking
+    and never see parts of different builds.
+    """
+
+    KINDS = ("products", "categories", "tags")
+    SHORT_PREFIX_LENGTH = 2
+    MAX_LIMIT = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = IndexSnapshot(keys=[], suggestions=[], top_by_short_prefix={}, version=None)
+
+    def _build(self, version) -> None:
+        entries = []
+        products = Product.objects.filter(is_deleted=False).values_list("pk", "title", "popularity")
+        for pk, title, popularity in products.iterator(chunk_size=5000):
+            entries.extend(self._get_entries(Suggestion("products", pk, title, popularity)))
+        for pk, title in Category.objects.filter(is_deleted=False).values_list("pk", "title"):
+            entries.extend(self._get_entries(Suggestion("categories", pk, title, 0)))
+        for pk, title in Tag.objects.values_list("pk", "title"):
+            entries.extend(self._get_entries(Suggestion("tags", pk, title, 0)))
+        entries.sort(key=lambda entry: entry[0])
+
+        top_by_short_prefix = defaultdict(lambda: {kind: [] for kind in self.KINDS})
+        for key, suggestion in entries:
+            for length in range(1, self.SHORT_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    top_by_short_prefix[key[:length]][suggestion.kind].append(suggestion)
+        for prefix, suggestions_by_kind in top_by_short_prefix.items():
+            for kind, suggestions in suggestions_by_kind.items():
+                suggestions_by_kind[kind] = self._get_top(suggestions, self.MAX_LIMIT)
+
+        self._snapshot = IndexSnapshot(
+            keys=[key for key, _ in entries],
+            suggestions=[suggestion for _, suggestion in entries],
+            top_by_short_prefix=dict(top_by_short_prefix),
+            version=version,
+        )
+
+    @staticmethod
+    def _get_entries(suggestion: Suggestion) -> list:
+        words = normalize_text(suggestion.title).split()
+        return [(" ".join(words[index:]), suggestion) for index in range(len(words))]
+
+    @staticmethod
+    def _get_top(suggestions, limit: int) -> list:
+        """Return up to `limit` unique suggestions with the highest weight."""
+        unique = {(suggestion.kind, suggestion.id): suggestion for suggestion in suggestions}
+        return heapq.nlargest(limit, unique.values(), key=lambda suggestion: (suggestion.weight, -suggestion.id))
+
+    def _ensure_fresh(self) -> None:
+        (version,) = get_versions(VERSION_SUGGESTIONS)
+        if version == self._snapshot.version:
+            return
+        if self._snapshot.version is None:
+            # Nothing to serve yet, wait for the index to be built
+            with self._lock:
+                if self._snapshot.version != version:
+                    self._build(version)
+        elif self._lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._build_in_background, args=(version,), daemon=True).start()
+            except RuntimeError:
+                self._lock.release()
+
+    def _build_in_background(self, version) -> None:
+        """Build the index and release the lock taken by the request which started the build."""
+        try:
+            self._build(version)
+        finally:
+            # The thread has its own database connection
+            connection.close()
+            self._lock.release()
+
+    def suggest(self, prefix: str, limit: int = 5) -> dict:
+        """Return dict with lists of top product, category and tag suggestions for the prefix."""
+        self._ensure_fresh()
+        snapshot = self._snapshot
+        prefix = normalize_text(prefix)
+        limit = min(limit, self.MAX_LIMIT)
+        if not prefix:
+            return {kind: [] for kind in self.KINDS}
+
+        if len(prefix) <= self.SHORT_PREFIX_LENGTH:
+            top = snapshot.top_by_short_prefix.get(prefix, {})
+            return {kind: top.get(kind, [])[:limit] for kind in self.KINDS}
+
+        keys, suggestions = snapshot.keys, snapshot.suggestions
+        matched_by_kind = {kind: [] for kind in self.KINDS}
+        index = bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            matched_by_kind[suggestions[index].kind].append(suggestions[index])
+            index += 1
+        return {kind: self._get_top(matched, limit) for kind, matched in matched_by_kind.items()}
+
+
+suggestion_index = SuggestionIndex()
@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from django.db.models import Q
+
+from products.discounts import get_offers_product_ids, offer_index
+from products.models import Offer, ProductPriceSummary
+from products.popularity import add_order_popularity
+from products.reservations import release_expired_reservations
+from products.thumbnails import generate_thumbnails
+from store.celery import app
+
+
+@app.task
+def refresh_price_summaries(product_ids):
+    """Recalculate price summaries of products after their offers changed."""
+    # Offers were changed by another process, make sure discounts are calculated with the actual ones
+    offer_index.reload()
+    ProductPriceSummary.refresh_for_products(product_ids)
+
+
+@app.task
+def refresh_offers_price_summaries(chunk_size=1000):
+    """
+    Recalculate price summaries of products whose offers start or end today. Run after midnight:
+    nothing is written when an offer starts or ends, so discounted prices aren't refreshed otherwise.
+    """
+    today = date.today()
+    offer_ids = Offer.objects.filter(
+        Q(date_start=today) | Q(date_end=today - timedelta(days=1)),
+        is_active=True,
+    ).values_list("pk", flat=True)
+    product_ids = sorted(get_offers_product_ids(offer_ids))
+    offer_index.reload()
+    for start in range(0, len(product_ids), chunk_size):
+        ProductPriceSummary.refresh_for_products(product_ids[start:start + chunk_size])
+
+
+@app.task
+def update_products_popularity(order_id, weight):
+    """Add items of the created or paid order to popularity scores of ordered products."""
+    add_order_popularity(order_id, weight)
+
+
+@app.task
+def update_orders_popularity(order_ids, weight):
+    """Add items of the orders paid in a batch to popularity scores of ordered products."""
+    for order_id in order_ids:
+        add_order_popularity(order_id, weight)
+
+
+@app.task
+def generate_image_thumbnails(name):
+    """Generate missing renditions of the uploaded image with given storage name."""
+    generate_thumbnails(name)
+
+
+@app.task
+def sweep_stock_reservations():
+    """Release expired stock reservations, so their quantities are available again."""
+    release_expired_reservations()
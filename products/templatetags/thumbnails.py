@@ -0,0 +1,23 @@
+from django import template
+from django.templatetags.static import static
+
+from products.thumbnails import get_thumbnail_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(image, size="medium", placeholder="assets/img/product-placeholder.png"):
+    """
+    Return URL of the image rendition of given size ("small", "medium" or "large").
+
+    Falls back to the original image while the rendition is being generated,
+    and to the static placeholder if there is no image.
+
+    Usage:
+        {% load thumbnails %}
+        <img src="{% thumbnail_url product.cover_image "medium" %}"/>
+    """
+    if not image:
+        return static(placeholder)
+    return get_thumbnail_url(image, size) or image.url
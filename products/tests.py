@@ -1 +1,76 @@
-# Create your tests here.
+from django.test import TestCase
+
+from products.models import Category, Product
+from products.pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title="Телевизоры")
+        # Equal sort values on purpose: pages must not repeat or skip products with ties
+        for index, (reviews_count, popularity) in enumerate(
+            [(0, 1.5), (2, 0.0), (2, 3.0), (1, 3.0), (0, 1.5), (2, 3.0), (1, 0.5), (0, 0.0)]
+        ):
+            Product.objects.create(
+                title=f"Товар {index}",
+                category=category,
+                reviews_count=reviews_count,
+                popularity=popularity,
+            )
+
+    def walk_forward(self, paginator: KeysetPaginator) -> list:
+        """Return all pages from the first to the last one following next cursors."""
+        pages = [paginator.get_page(None)]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return pages
+
+    def assert_pages_follow_ordering(self, ordering: list, expected_ordering: list):
+        paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=3)
+        pages = self.walk_forward(paginator)
+
+        expected = list(Product.objects.order_by(*expected_ordering).values_list("pk", flat=True))
+        self.assertEqual([product.pk for page in pages for product in page], expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertFalse(pages[0].has_previous())
+        self.assertFalse(pages[-1].has_next())
+
+    def test_descending_field_with_ties(self):
+        self.assert_pages_follow_ordering(["-reviews_count"], ["-reviews_count", "-pk"])
+
+    def test_fields_in_mixed_directions(self):
+        self.assert_pages_follow_ordering(["reviews_count", "-popularity"], ["reviews_count", "-popularity", "pk"])
+        self.assert_pages_follow_ordering(["-popularity", "reviews_count"], ["-popularity", "reviews_count", "-pk"])
+
+    def test_datetime_field(self):
+        self.assert_pages_follow_ordering(["-updated"], ["-updated", "-pk"])
+
+    def test_previous_cursors_return_previous_pages(self):
+        paginator = KeysetPaginator(Product.objects.all(), ["reviews_count", "-popularity"], per_page=3)
+        pages = self.walk_forward(paginator)
+
+        for index in range(len(pages) - 1, 0, -1):
+            previous_page = paginator.get_page(pages[index].previous_cursor)
+            self.assertEqual(list(previous_page), list(pages[index - 1]))
+        # Going back to the first page ends there
+        self.assertFalse(paginator.get_page(pages[1].previous_cursor).has_previous())
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), ["-reviews_count"], per_page=3)
+        first_page = paginator.get_page(None)
+        cursor = first_page.next_cursor
+
+        tampered_cursor = cursor[:-1] + ("A" if cursor[-1] != "A" else "B")
+        with self.assertRaises(InvalidCursor):
+            paginator.decode_cursor(tampered_cursor)
+        self.assertEqual(list(paginator.get_page(tampered_cursor)), list(first_page))
+        self.assertEqual(list(paginator.get_page("garbage")), list(first_page))
+
+    def test_cursor_of_another_ordering_is_rejected(self):
+        cursor = KeysetPaginator(Product.objects.all(), ["-reviews_count"], per_page=3).get_page(None).next_cursor
+        paginator = KeysetPaginator(Product.objects.all(), ["-popularity"], per_page=3)
+
+        with self.assertRaises(InvalidCursor):
+            paginator.decode_cursor(cursor)
+        self.assertEqual(list(paginator.get_page(cursor)), list(paginator.get_page(None)))
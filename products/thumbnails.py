@@ -0,0 +1,113 @@
+"""
+Contains image renditions: fixed-size thumbnails generated with Pillow in background
+and stored in the same storage next to the original images.
+"""
+import os
+from io import BytesIO
+from typing import Optional
+
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+# Rendition names and the boxes thumbnails are fit into, keeping the aspect ratio
+THUMBNAIL_SIZES = {
+    "small": (100, 100),
+    "medium": (300, 300),
+    "large": (800, 800),
+}
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMBNAIL_QUALITY = 80
+
+THUMBNAIL_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Missing renditions are checked again after this number of seconds
+THUMBNAIL_MISSING_CACHE_TIMEOUT = 60
+# Generation is not scheduled again for the same image during this number of seconds
+THUMBNAIL_PENDING_TIMEOUT = 60 * 10
+
+
+def get_thumbnail_name(name: str, size: str) -> str:
+    """Return storage name of the rendition of given size: `images/photo.jpg` -> `images/photo.300x300.webp`."""
+    width, height = THUMBNAIL_SIZES[size]
+    root, _ = os.path.splitext(name)
+    return f"{root}.{width}x{height}.{THUMBNAIL_FORMAT.lower()}"
+
+
+def get_thumbnail_cache_key(name: str, size: str) -> str:
+    return f"thumbnail_{size}_{name}"
+
+
+def generate_thumbnails(name: str, storage=default_storage) -> list:
+    """
+    Generate all missing renditions of the image with given storage name and return their names.
+    Non-raster images (e.g. SVG), missing files and files outside the storage are skipped.
+    """
+    try:
+        missing_sizes = [size for size in THUMBNAIL_SIZES if not storage.exists(get_thumbnail_name(name, size))]
+    except SuspiciousFileOperation:
+        return []
+    if not missing_sizes:
+        return []
+
+    try:
+        with storage.open(name) as file:
+            original = Image.open(file)
+            original.load()
+    except (FileNotFoundError, UnidentifiedImageError):
+        return []
+
+    original = ImageOps.exif_transpose(original).convert("RGBA")
+    if THUMBNAIL_FORMAT == "JPEG":
+        # JPEG has no transparency, put the image on white background
+        background = Image.new("RGB", original.size, "white")
+        background.paste(original, mask=original.getchannel("A"))
+        original = background
+
+    generated = []
+    for size in missing_sizes:
+        thumbnail = original.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZES[size], Image.LANCZOS)
+        content = BytesIO()
+        thumbnail.save(content, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        thumbnail_name = storage.save(get_thumbnail_name(name, size), ContentFile(content.getvalue()))
+        cache.set(get_thumbnail_cache_key(name, size), storage.url(thumbnail_name), THUMBNAIL_CACHE_TIMEOUT)
+        generated.append(thumbnail_name)
+    return generated
+
+
+def schedule_thumbnails_generation(name: str) -> None:
+    """Generate renditions of the image in background, unless it's already scheduled."""
+    from products.tasks import generate_image_thumbnails
+
+    if cache.add(f"thumbnail_pending_{name}", True, THUMBNAIL_PENDING_TIMEOUT):
+        generate_image_thumbnails.delay(name)
+
+
+def get_thumbnail_url(image, size: str) -> Optional[str]:
+    """
+    Return URL of the rendition of given size for the image field file, or None if it's not generated yet
+    (its generation is scheduled then). Results are cached, so the storage is checked once per rendition.
+
+    Images outside the storage (e.g. default images pointing to static files) have no renditions.
+    """
+    cache_key = get_thumbnail_cache_key(image.name, size)
+    url = cache.get(cache_key)
+    if url is not None:
+        return url or None
+
+    thumbnail_name = get_thumbnail_name(image.name, size)
+    try:
+        exists = image.storage.exists(thumbnail_name)
+    except SuspiciousFileOperation:
+        cache.set(cache_key, "", THUMBNAIL_CACHE_TIMEOUT)
+        return None
+    if exists:
+        url = image.storage.url(thumbnail_name)
+        cache.set(cache_key, url, THUMBNAIL_CACHE_TIMEOUT)
+        return url
+
+    cache.set(cache_key, "", THUMBNAIL_MISSING_CACHE_TIMEOUT)
+    schedule_thumbnails_generation(image.name)
+    return None
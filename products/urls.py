@@ -3,12 +3,15 @@ from django.urls import path
 from products.views import (CartDetailView, CatalogView, CompareView,
                             ProductDetailsView, SaleView, add_to_comparison,
                             cart_add_product, cart_add_product_position,
-                            cart_remove)
+                            cart_remove, catalog_by_page, suggest)
 
 app_name = "products"
 urlpatterns = [
     path("catalog/", CatalogView.as_view(), name="catalog"),
-    path("catalog//<int:page>", CatalogView.listing, name="catalog-by-page"),
+    path("catalog/<int:page>/", catalog_by_page, name="catalog-by-page"),
+    # Legacy URL of catalog pages
+    path("catalog//<int:page>", catalog_by_page),
+    path("suggest/", suggest, name="suggest"),
     path("product/<int:pk>/", ProductDetailsView.as_view(), name="product"),
     path("compare/", CompareView.as_view(), name="compare"),
     path("add_to_comparison/<int:pk>/", add_to_comparison, name="add_to_comparison"),
@@ -1,19 +1,34 @@
-from datetime import datetime
-
-from django.core.paginator import Paginator
-from django.db.models import Avg, Count, Max, Min, Q, Sum
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
-from django.shortcuts import get_object_or_404, redirect, render
-from django.urls import reverse_lazy
-from django.views.decorators.http import require_POST
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Max, Min, Value
+from django.db.models.functions import Coalesce
+from django.http import (HttpRequest, HttpResponse, HttpResponseRedirect,
+                         JsonResponse)
+from django.shortcuts import get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import DetailView, ListView, TemplateView
 from django.views.generic.base import ContextMixin
 
+from products.caching import (CATALOG_CACHE_TIMEOUT, get_catalog_cache_key,
+                              get_catalog_count_cache_key,
+                              get_catalog_facets_cache_key,
+                              get_catalog_version, normalize_catalog_params)
 from products.cart import Cart
+from products.categories import category_tree
+from products.discounts import DiscountResolver, offer_index
+from products.facets import CatalogFacets
 from products.forms import (AddProductToCartForm, ProductFilterForm,
                             ReviewCreationForm)
 from products.models import (AdBanner, Category, Offer, Product,
-                             ProductPosition, Review)
+                             ProductPosition, ProductPriceSummary, Review)
+from products.pagination import CachedCountPaginator, KeysetPaginator
+from products.reservations import get_available_quantity
+from products.search import search_products
+from products.suggestions import suggestion_index
 from users.models import Action
 from users.utils import create_action
 
@@ -23,11 +38,7 @@ class BaseMixin(ContextMixin):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["categories"] = (
-            Category.objects.filter(parent=None, is_deleted=False)
-            .order_by("pk")
-            .prefetch_related("subcategories")
-        )
+        context["categories"] = category_tree.roots
         return context
 
 
@@ -37,18 +48,20 @@ class IndexView(BaseMixin, TemplateView):
     def get_context_data(self, **kwargs):
         """Put current "Limited offer" chosen product and Ad banner into context."""
         context = super().get_context_data(**kwargs)
+        popular_products = list(Product.get_popular_products())
+        limited_edition_products = list(Product.get_limited_edition_products())
+        # Resolve discounted prices for all product cards at once
+        DiscountResolver(popular_products + limited_edition_products).annotate_products()
+
         context_data = {
             "chosen_product": Product.objects.filter(is_chosen=True).first(),
             "featured_categories": Category.get_featured_categories(),
-            "popular_products": Product.get_popular_products(),
-            "limited_edition_products": Product.get_limited_edition_products(),
+            "popular_products": popular_products,
+            "limited_edition_products": limited_edition_products,
             "banners": AdBanner.get_banners(),
-            "categories": Category.objects.filter(parent=None, is_deleted=False)
-            .order_by("pk")
-            .prefetch_related("subcategories")
         }
         context.update(context_data)
-        return context_data
+        return context
 
 
 class CatalogView(BaseMixin, ListView):
@@ -62,7 +75,8 @@ class CatalogView(BaseMixin, ListView):
     )
     context_object_name = "products"
 
-    def get_queryset(self):
+    def get_filtered_queryset(self):
+        """Return products filtered by search query, stock, shipping and price, but not by facets."""
         queryset = (
             Product.objects.filter(is_deleted=False)
             .select_related("category")
@@ -76,76 +90,105 @@ class CatalogView(BaseMixin, ListView):
             in_stock = form.cleaned_data.get("in_stock")
             free_shipping = form.cleaned_data.get("free_shipping")
             price_range = self.request.GET.get("price")
-            sort_param = self.request.GET.get("sort_param")
-            tag_chosen = self.request.GET.get("tags")
-
-            if product_name:
-                queryset = queryset.filter(
-                    Q(title__icontains=product_name)
-                    | Q(title__icontains=product_name.capitalize())
-                    | Q(title__icontains=product_name.lower())
-                )
 
-            query = self.request.GET.get("query")
+            # Search by the header search field and the product name from the filter form at once
+            query = " ".join(text for text in (self.request.GET.get("query"), product_name) if text)
             if query:
-                queryset = queryset.filter(
-                    Q(title__icontains=query)
-                    | Q(title__icontains=query.capitalize())
-                    | Q(title__icontains=query.lower())
-                )
-            category = self.request.GET.get("category")
-            if category:
-                queryset = queryset.filter(category=category)
+                queryset = search_products(queryset, query)
 
             if in_stock:
-                queryset = queryset.annotate(total_quantity=Sum("productposition__quantity"))
-                queryset = queryset.filter(total_quantity__gt=0)
+                queryset = queryset.filter(price_summary__available_quantity__gt=0)
 
             if free_shipping:
-                queryset = queryset.filter(productposition__free_shipping=True)
-
-            if price_range or sort_param == "price_l2h" or sort_param == "price_h2l":
-                queryset = queryset.annotate(price=Avg("productposition__price"))
+                queryset = queryset.filter(price_summary__free_shipping=True)
 
             if price_range:
                 min_price, max_price = map(int, price_range.split(";"))
-                queryset = queryset.filter(price__gte=min_price, price__lte=max_price)
-
-            if sort_param == "price_l2h":
-                queryset = queryset.order_by("price")
-
-            elif sort_param == "price_h2l":
-                queryset = queryset.order_by("-price")
+                queryset = queryset.filter(
+                    price_summary__avg_price__gte=min_price,
+                    price_summary__avg_price__lte=max_price,
+                )
 
-            if sort_param == "pop_l2h":
-                queryset = queryset.annotate(count_orders=Count("productposition__orderitem__order"))
-                queryset = queryset.order_by("count_orders")
-            elif sort_param == "pop_h2l":
-                queryset = queryset.annotate(count_orders=Count("productposition__orderitem__order"))
-                queryset = queryset.order_by("-count_orders")
+        return queryset
 
-            if sort_param == "review_l2h":
-                queryset = queryset.annotate(count_reviews=Count("reviews"))
-                queryset = queryset.order_by("count_reviews")
-            elif sort_param == "review_h2l":
-                queryset = queryset.annotate(count_reviews=Count("reviews"))
-                queryset = queryset.order_by("-count_reviews")
+    # Orderings for "sort_param" values; every field is a column or an annotation of products,
+    # so that they can be used as keys of cursor pagination
+    SORT_ORDERINGS = {
+        "price_l2h": ["sort_price"],
+        "price_h2l": ["-sort_price"],
+        "pop_l2h": ["popularity"],
+        "pop_h2l": ["-popularity"],
+        "review_l2h": ["reviews_count"],
+        "review_h2l": ["-reviews_count"],
+        "new_l2h": ["updated"],
+        "new_h2l": ["-updated"],
+    }
+
+    def get_ordering(self, queryset):
+        sort_param = self.request.GET.get("sort_param")
+        if sort_param in self.SORT_ORDERINGS:
+            ordering = self.SORT_ORDERINGS[sort_param]
+        elif "rank" in queryset.query.annotations:
+            # Search results are ordered by relevance (the search is skipped if the filter form is invalid)
+            ordering = ["-rank", "-similarity"]
+        else:
+            ordering = Product._meta.ordering
+        # Primary key makes the ordering total, otherwise products with equal values may jump between pages
+        return [*ordering, "-pk" if ordering[0].startswith("-") else "pk"]
 
-            if sort_param == "new_l2h":
-                queryset = queryset.order_by("updated")
-            elif sort_param == "new_h2l":
-                queryset = queryset.order_by("-updated")
+    def get_queryset(self):
+        queryset = self.facets.filter(self.get_filtered_queryset())
+        ordering = self.get_ordering(queryset)
+        if "sort_price" in ordering or "-sort_price" in ordering:
+            # Products without positions go first when sorting by price ascending
+            queryset = queryset.annotate(sort_price=Coalesce("price_summary__avg_price", Value(Decimal(0))))
+        return queryset.order_by(*ordering)
+
+    def is_cursor_pagination(self) -> bool:
+        return self.request.GET.get("pagination") == "cursor"
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """Return paginator with the total count of products cached for the filter set."""
+        return CachedCountPaginator(
+            queryset,
+            per_page,
+            orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+            count_cache_key=get_catalog_count_cache_key(self.request.GET),
+            count_cache_timeout=CATALOG_CACHE_TIMEOUT,
+            **kwargs,
+        )
 
-            if tag_chosen:
-                queryset = queryset.filter(tags=tag_chosen)
+    def paginate_queryset(self, queryset, page_size):
+        """Paginate by cursor tokens instead of page numbers if "pagination=cursor" is requested."""
+        if not self.is_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, self.get_ordering(queryset), page_size)
+        page = paginator.get_page(self.request.GET.get("cursor"))
+        return paginator, page, page.object_list, page.has_next() or page.has_previous()
 
-        return queryset
+    def get(self, request, *args, **kwargs):
+        """
+        Render catalog using cached content (product cards and pagination) if there is one
+        for the same filter parameters and versions of products, positions and offers.
+        Only the content is cached: the rest of the page (e.g. cart in the header) is user specific.
+        """
+        self.facets = CatalogFacets(request.GET)
+        self.catalog_cache_key = get_catalog_cache_key(request.GET)
+        self.catalog_content = cache.get(self.catalog_cache_key)
+        if self.catalog_content is not None:
+            # Skip querying and paginating products
+            self.object_list = Product.objects.none()
+            self.paginate_by = None
+            return self.render_to_response(self.get_context_data())
+        return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         price_range = self.request.GET.get("price")
-        min_price_of_all = ProductPosition.objects.values("price").aggregate(Min("price"))["price__min"]
-        max_price_of_all = ProductPosition.objects.values("price").aggregate(Max("price"))["price__max"]
+        price_limits = ProductPriceSummary.objects.aggregate(Min("min_price"), Max("max_price"))
+        min_price_of_all = price_limits["min_price__min"]
+        max_price_of_all = price_limits["max_price__max"]
         sort_param = self.request.GET.get("sort_param")
         if price_range:
             min_price, max_price = map(int, price_range.split(";"))
@@ -158,31 +201,46 @@ class CatalogView(BaseMixin, ListView):
         context["max_price_of_all"] = max_price_of_all
         context["sort_param"] = sort_param
         context["filter_form"] = ProductFilterForm(self.request.GET)
-
-        payload = ""
-        for k, list_ in self.request.GET.lists():
-            if k == "page":
-                continue
-            for v in list_:
-                payload += "&" + k + "=" + v
-        context["payload"] = payload
-
-        payload = ""
-        for k, list_ in self.request.GET.lists():
-            if k == "page" or k == "sort_param":
-                continue
-            for v in list_:
-                payload += "&" + k + "=" + v
-        context["sort_payload"] = payload
+        facet_counts = self.get_facet_counts()
+        context["facets"] = [
+            (facet, title, facet_counts[facet]) for facet, title in CatalogFacets.FACET_TITLES.items()
+        ]
+
+        # Build query strings from normalized parameters only, so cached content doesn't depend on the rest of them
+        params = normalize_catalog_params(self.request.GET)
+        params.pop("page", None)
+        params.pop("cursor", None)
+        context["payload"] = "&" + urlencode(params, doseq=True) if params else ""
+        params.pop("sort_param", None)
+        context["sort_payload"] = "&" + urlencode(params, doseq=True) if params else ""
+        context["cursor_pagination"] = self.is_cursor_pagination()
+
+        if self.catalog_content is None:
+            # Resolve discounted prices for all product cards on the page at once
+            context["products"] = DiscountResolver(context["products"]).annotate_products()
+            context["catalog_version"] = get_catalog_version()
+            context["catalog_cache_timeout"] = CATALOG_CACHE_TIMEOUT
+            self.catalog_content = render_to_string("products/catalog_content.html", context, self.request)
+            cache.set(self.catalog_cache_key, self.catalog_content, CATALOG_CACHE_TIMEOUT)
+        context["catalog_content"] = self.catalog_content
 
         return context
 
-    def listing(self):
-        catalog = Product.objects.all()
-        paginator = Paginator(catalog, 6)
-        page_number = self.GET.get("page")
-        page_obj = paginator.get_page(page_number)
-        return render(self, "products/catalog.html", {"page_obj": page_obj})
+    def get_facet_counts(self) -> dict:
+        """Return facet counts for current filters, cached until products or positions change."""
+        cache_key = get_catalog_facets_cache_key(self.request.GET)
+        facet_counts = cache.get(cache_key)
+        if facet_counts is None:
+            facet_counts = self.facets.get_counts(self.get_filtered_queryset())
+            cache.set(cache_key, facet_counts, CATALOG_CACHE_TIMEOUT)
+        return facet_counts
+
+
+def catalog_by_page(request: HttpRequest, page: int) -> HttpResponse:
+    """Redirect legacy catalog page URLs to the catalog with the "page" parameter."""
+    params = request.GET.copy()
+    params["page"] = page
+    return redirect(f"{reverse('products:catalog')}?{params.urlencode()}")
 
 
 class ProductDetailsView(BaseMixin, DetailView):
@@ -325,13 +383,12 @@ class CompareView(BaseMixin, TemplateView):
 class SaleView(BaseMixin, ListView):
     model = Offer
     template_name = "products/sale.html"
-    queryset = Offer.objects.filter(
-        is_active=True,
-        date_start__lte=datetime.now(),
-        date_end__gte=datetime.now(),
-    ).prefetch_related("products", "categories")
     context_object_name = "offers"
 
+    def get_queryset(self):
+        """Return active offers from the in-process offer index."""
+        return list(offer_index.get_offers())
+
 
 @require_POST
 def cart_add_product(request: HttpRequest, product_id: int) -> HttpResponse:
@@ -362,11 +419,8 @@ def cart_add_product(request: HttpRequest, product_id: int) -> HttpResponse:
     form = AddProductToCartForm(request.POST)
     if form.is_valid():
         data = form.cleaned_data
-        quantity = (
-            data["quantity"]
-            if int(data["quantity"]) <= cheapest_position.quantity
-            else cheapest_position.quantity
-        )
+        available_quantity = get_available_quantity(cheapest_position, request.session.session_key)
+        quantity = min(int(data["quantity"]), available_quantity)
         cart.add(
             product_position=cheapest_position,
             quantity=quantity,
@@ -398,12 +452,9 @@ def cart_add_product_position(
     form = AddProductToCartForm(request.POST)
     if form.is_valid():
         data = form.cleaned_data
-        # Add only available quantity
-        quantity = (
-            data["quantity"]
-            if int(data["quantity"]) <= product_position.quantity
-            else product_position.quantity
-        )
+        # Add only available quantity, not held by other buyers
+        available_quantity = get_available_quantity(product_position, request.session.session_key)
+        quantity = min(int(data["quantity"]), available_quantity)
         cart.add(
             product_position=product_position,
             quantity=quantity,
@@ -441,3 +492,41 @@ def cart_remove(request: HttpRequest, product_position_id) -> HttpResponse:
 
 class CartDetailView(BaseMixin, TemplateView):
     template_name = "orders/cart.html"
+
+    def get_context_data(self, **kwargs):
+        """Share one cart with the template, so that its product positions are fetched once."""
+        context = super().get_context_data(**kwargs)
+        context["cart"] = Cart(self.request)
+        return context
+
+
+@require_GET
+def suggest(request: HttpRequest) -> JsonResponse:
+    """
+    Return JSON with top product, category and tag suggestions for the prefix typed into the search field.
+
+    GET parameters:
+        q: prefix typed by the user.
+        limit: maximum number of suggestions of each kind (5 by default, 10 at most).
+    """
+    prefix = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", 5))
+    except ValueError:
+        limit = 5
+
+    suggestions = suggestion_index.suggest(prefix, limit=max(limit, 1))
+    catalog_url = reverse("products:catalog")
+    urls = {
+        "products": lambda suggestion: reverse("products:product", args=(suggestion.id,)),
+        "categories": lambda suggestion: f"{catalog_url}?category={suggestion.id}",
+        "tags": lambda suggestion: f"{catalog_url}?tags={suggestion.id}",
+    }
+    data = {
+        kind: [
+            {"id": suggestion.id, "title": suggestion.title, "url": urls[kind](suggestion)}
+            for suggestion in kind_suggestions
+        ]
+        for kind, kind_suggestions in suggestions.items()
+    }
+    return JsonResponse(data)
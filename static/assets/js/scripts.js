@@ -857,6 +857,43 @@ Product().init();
 var ProgressPayment = function(){
     return {
         init: function(){
+            // Poll payment status of the order until it's paid or declined
+            var $progress = $('.ProgressPayment[data-status-url]');
+            if (!$progress.length || !window.fetch) {
+                return;
+            }
+            var url = $progress.data('status-url'),
+                delay = 1000;
+            var poll = function(){
+                fetch(url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+                    .then(function(response){
+                        // The order is not available to this user, stop polling
+                        if (response.status === 404) {
+                            return null;
+                        }
+                        if (!response.ok) {
+                            throw new Error(response.status);
+                        }
+                        return response.json();
+                    })
+                    .then(function(data){
+                        if (!data) {
+                            return;
+                        }
+                        if (data.is_final) {
+                            $progress.find('.ProgressPayment-status').text('Статус заказа: ' + data.status_display);
+                            $progress.find('.ProgressPayment-icon').hide();
+                            return;
+                        }
+                        delay = Math.min(delay * 1.5, 10000);
+                        setTimeout(poll, delay);
+                    })
+                    .catch(function(){
+                        delay = Math.min(delay * 2, 30000);
+                        setTimeout(poll, delay);
+                    });
+            };
+            setTimeout(poll, delay);
         }
     };
 };
@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 
 import environ
+from celery.schedules import crontab
 from django.urls import reverse_lazy
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.sites",
+    "django.contrib.postgres",
     # Third party apps
     "allauth",
     "allauth.account",
@@ -176,9 +178,40 @@ ACCOUNT_UNIQUE_EMAIL = True
 ACCOUNT_LOGOUT_ON_GET = True
 ACCOUNT_LOGOUT_REDIRECT_URL = reverse_lazy("account_login")
 
+# Cache shared by all web and Celery processes: version stamps kept in it invalidate cached pages
+# and in-process indexes (offers, categories, suggestions) of every process
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("CACHE_URL", default="redis://127.0.0.1:6379/1"),
+    }
+}
+
 CART_SESSION_ID = "cart"
+# Cart storage backend: `products.cart_storage.SessionCartStorage` or `products.cart_storage.DatabaseCartStorage`
+CART_STORAGE = env("CART_STORAGE", default="products.cart_storage.SessionCartStorage")
 ORDER_SESSION_ID = "order"
 CELERY_BROKER_URL = env("CELERY_BROKER_URL")
+# Payment verification: "single" task per payment or "batch" mode with `process_payments` consumer command
+PAYMENT_PROCESSING_MODE = env("PAYMENT_PROCESSING_MODE", default="single")
+PAYMENT_BATCH_SIZE = env.int("PAYMENT_BATCH_SIZE", default=500)
+PAYMENT_BATCH_FLUSH_INTERVAL = env.float("PAYMENT_BATCH_FLUSH_INTERVAL", default=1.0)
+# Payment attempts not finished within this number of seconds are marked as unpaid (see `Order.expire_payments`)
+PAYMENT_PROCESSING_TIMEOUT = env.int("PAYMENT_PROCESSING_TIMEOUT", default=900)
+CELERY_BEAT_SCHEDULE = {
+    "sweep-stock-reservations": {
+        "task": "products.tasks.sweep_stock_reservations",
+        "schedule": 60,
+    },
+    "refresh-offers-price-summaries": {
+        "task": "products.tasks.refresh_offers_price_summaries",
+        "schedule": crontab(hour=0, minute=5),
+    },
+    "expire-stale-payments": {
+        "task": "orders.tasks.expire_stale_payments",
+        "schedule": 60,
+    },
+}
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = env("EMAIL_HOST")
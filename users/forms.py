@@ -3,6 +3,7 @@ import re
 from django import forms
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm
 
+from orders.models import Order
 from users.models import CustomUser
 
 
@@ -99,3 +100,24 @@ class CustomUserChangeFormAdmin(UserChangeForm):
                 if image.size > 2 * 1024 * 1024:
                     raise forms.ValidationError("Файл слишком большой. Максимальный размер - 2 МБ.")
         return image
+
+
+class OrderHistoryFilterForm(forms.Form):
+    """Form to filter the user's order history by status and creation date."""
+
+    status = forms.ChoiceField(
+        required=False,
+        label="Статус",
+        choices=[("", "Все статусы"), *Order.STATUS_CHOICES],
+        widget=forms.Select(attrs={"class": "form-select"})
+    )
+    date_from = forms.DateField(
+        required=False,
+        label="С",
+        widget=forms.DateInput(attrs={"class": "form-input", "type": "date"})
+    )
+    date_to = forms.DateField(
+        required=False,
+        label="По",
+        widget=forms.DateInput(attrs={"class": "form-input", "type": "date"})
+    )
@@ -1,14 +1,18 @@
+from datetime import datetime, time, timedelta
+
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.cache import cache
 from django.core.mail import send_mail
+from django.db.models import Prefetch
 from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.views.generic import TemplateView, UpdateView
 
-from orders.models import Order
-from users.forms import CustomUserChangeForm
+from orders.models import Order, OrderItem
+from products.pagination import KeysetPaginator
+from users.forms import CustomUserChangeForm, OrderHistoryFilterForm
 from users.models import Action, CustomUser
 
 
@@ -18,8 +22,10 @@ class AccountDetailView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["user"] = self.request.user
-        context["latest_order"] = Order.objects.filter(client_id=self.request.user).order_by("-created").first()
-        context["actions"] = Action.objects.filter(verb=Action.VIEW_PRODUCT, user=self.request.user)[:3]
+        context["latest_order"] = Order.objects.filter(client=self.request.user).order_by("-created", "-pk").first()
+        context["actions"] = Action.objects.filter(verb=Action.VIEW_PRODUCT, user=self.request.user).prefetch_related(
+            "target__category", "target__images", "target__price_summary"
+        )[:3]
         return context
 
 
@@ -101,14 +107,52 @@ class PasswordView(TemplateView):
             return JsonResponse({"status": "error", "message": "Invalid or expired code."})
 
 
-class HistoryOrderView(TemplateView):
+class HistoryOrderView(LoginRequiredMixin, TemplateView):
+    """
+    Order history of the user, newest orders first, filtered by status and creation date.
+    Orders are paginated by cursor tokens, so pages of long histories are as fast as the first one.
+    """
+
     template_name = "users/historyorder.html"
+    paginate_by = 10
+
+    def get_queryset(self):
+        queryset = Order.objects.filter(client=self.request.user)
+
+        form = self.filter_form = OrderHistoryFilterForm(self.request.GET)
+        if form.is_valid():
+            status = form.cleaned_data.get("status")
+            date_from = form.cleaned_data.get("date_from")
+            date_to = form.cleaned_data.get("date_to")
+            if status:
+                queryset = queryset.filter(status=status)
+            # Compare creation time with bounds of the days, so that the index on it is used
+            if date_from:
+                queryset = queryset.filter(created__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+            if date_to:
+                queryset = queryset.filter(
+                    created__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+                )
+
+        order_items = OrderItem.objects.select_related("product_position__product", "product_position__seller")
+        return queryset.prefetch_related(
+            Prefetch("orderitem_set", queryset=order_items),
+            "orderitem_set__product_position__product__images",
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["user"] = self.request.user
-        context["orders"] = Order.objects.filter(client_id=self.request.user)
+        page = KeysetPaginator(self.get_queryset(), ["-created"], self.paginate_by).get_page(
+            self.request.GET.get("cursor")
+        )
+        context["orders"] = context["page_obj"] = page
+        context["filter_form"] = self.filter_form
 
+        # Filter parameters to keep in the pagination links
+        params = self.request.GET.copy()
+        params.pop("cursor", None)
+        context["payload"] = f"&{params.urlencode()}" if params else ""
         return context
 
 
@@ -129,5 +173,7 @@ class ActionListView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["actions"] = Action.objects.filter(verb=Action.VIEW_PRODUCT, user=self.request.user)[:20]
+        context["actions"] = Action.objects.filter(verb=Action.VIEW_PRODUCT, user=self.request.user).prefetch_related(
+            "target__category", "target__images", "target__price_summary"
+        )[:20]
         return context